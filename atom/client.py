@@ -80,6 +80,18 @@ class AtomPubClient(object):
       The results of calling self.http_client.request. With the default
       http_client, this is an HTTP response object.
     """
+    http_request = self._build_request(method=method, uri=uri,
+                                       auth_token=auth_token,
+                                       http_request=http_request, **kwargs)
+    # Perform the fully specified request using the http_client instance.
+    # Sends the request to the server and returns the server's response.
+    return self.http_client.request(http_request)
+
+  Request = request
+
+  def _build_request(self, method=None, uri=None, auth_token=None,
+                     http_request=None, **kwargs):
+    """Returns the fully specified HttpRequest which request would send."""
     # Modify the request based on the AtomPubClient settings and parameters
     # passed in to the request.
     http_request = self.modify_request(http_request)
@@ -112,11 +124,7 @@ class AtomPubClient(object):
     if http_request.uri.host is None:
       raise MissingHost('No host provided in request %s %s' % (
           http_request.method, str(http_request.uri)))
-    # Perform the fully specified request using the http_client instance.
-    # Sends the request to the server and returns the server's response.
-    return self.http_client.request(http_request)
-
-  Request = request
+    return http_request
 
   def get(self, uri=None, auth_token=None, http_request=None, **kwargs):
     """Performs a request using the GET method, returns an HTTP response."""
@@ -22,6 +22,7 @@ __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
 import inspect
+import threading
 try:
   from xml.etree import cElementTree as ElementTree
 except ImportError:
@@ -39,37 +40,153 @@ try:
 except ImportError:
     xmlString = None
 
+# XmlElement.to_string writes XML directly from the objects when the
+# ElementTree in use serializes with the ElementTree 1.3 rules, which the
+# direct writer reproduces byte for byte (down to the escaping functions,
+# which it borrows). With older versions it builds a tree and uses
+# ElementTree.tostring.
+try:
+  from xml.etree import ElementTree as _ElementTreeSerializer
+  if (not hasattr(_ElementTreeSerializer, 'register_namespace')
+      or ElementTree.tostring is not _ElementTreeSerializer.tostring):
+    _ElementTreeSerializer = None
+except ImportError:
+  _ElementTreeSerializer = None
+
 STRING_ENCODING = 'utf-8'
 
+# Shared stand-ins for an element's _other_elements and _other_attributes
+# when it has none, used when reading them internally so that an element
+# with no extensions never allocates the containers.
+_NO_ELEMENTS = ()
+_NO_ATTRIBUTES = {}
+
+
+def _is_member_definition(name, value):
+  """Returns True if the class attribute name = value declares an XML member
+  (see XmlElement._list_xml_members)."""
+  return (not name.startswith('_') and name != 'text'
+          and (isinstance(value, (tuple, list, str, unicode))
+               or (inspect.isclass(value) and issubclass(value, XmlElement))))
+
+
+class _MemberDescriptor(object):
+  """Takes the place of a member definition in an XmlElement class.
+
+  Reading the attribute from the class gives back the definition, as if
+  the descriptor weren't there. An instance only stores the members which
+  have been set (in its __dict__, which takes precedence over this
+  non-data descriptor); unset members read as None, or as a new empty list
+  for repeating elements, which is then kept so it can be appended to.
+  """
+
+  def __init__(self, name, definition):
+    self.name = name
+    self.definition = definition
+    self.repeating = isinstance(definition, list)
+
+  def __get__(self, instance, owner):
+    if instance is None:
+      return self.definition
+    if self.repeating:
+      value = instance.__dict__[self.name] = []
+      return value
+    return None
+
+
+class _ExtensionContainer(object):
+  """Creates an instance's _other_elements or _other_attributes on first
+  use (see _NO_ELEMENTS and _NO_ATTRIBUTES)."""
+
+  def __init__(self, name, factory):
+    self.name = name
+    self.factory = factory
+
+  def __get__(self, instance, owner):
+    if instance is None:
+      return None
+    value = instance.__dict__[self.name] = self.factory()
+    return value
+
+
+def _get_qname(element, version):
+  if isinstance(element._qname, tuple):
+    if version <= len(element._qname):
+      return element._qname[version-1]
+    else:
+      return element._qname[-1]
+  else:
+    return element._qname
+
+
+def _compile_members(cls):
+  """Builds the member and rule tables for an XmlElement class."""
+  type.__setattr__(cls, '_members', tuple(cls._list_xml_members()))
+  type.__setattr__(cls, '_member_names',
+                   frozenset([name for name, ignored in cls._members]))
+  type.__setattr__(cls, '_rule_set', None)
+  type.__setattr__(cls, '_serialization_rules', None)
+  cls._get_rules(1)
+  cls._get_rules(2)
+
+
+class _XmlElementMetaclass(type):
+  """Precompiles the member and parsing rule tables for each XmlElement
+  class when it is created, rather than on first use, and replaces member
+  definitions with _MemberDescriptors so that instances only store the
+  members they actually have.
+
+  Members can still be added to a class after it has been created (for
+  example, SomeEntry.new_member = SomeElement); the tables for the class
+  and its subclasses are rebuilt when that happens.
+  """
+
+  def __init__(cls, name, bases, d):
+    type.__init__(cls, name, bases, d)
+    for member_name, value in d.items():
+      if _is_member_definition(member_name, value):
+        type.__setattr__(cls, member_name,
+                         _MemberDescriptor(member_name, value))
+    _compile_members(cls)
+
+  def __setattr__(cls, name, value):
+    if _is_member_definition(name, value):
+      type.__setattr__(cls, name, _MemberDescriptor(name, value))
+      pending = [cls]
+      while pending:
+        affected = pending.pop()
+        _compile_members(affected)
+        pending.extend(type.__subclasses__(affected))
+    else:
+      type.__setattr__(cls, name, value)
+
 
 class XmlElement(object):
   """Represents an element node in an XML document.
 
   The text member is a UTF-8 encoded str or unicode.
   """
+  __metaclass__ = _XmlElementMetaclass
+
   _qname = None
-  _other_elements = None
-  _other_attributes = None
+  _other_elements = _ExtensionContainer('_other_elements', list)
+  _other_attributes = _ExtensionContainer('_other_attributes', dict)
   # The rule set contains mappings for XML qnames to child members and the
   # appropriate member classes.
   _rule_set = None
   _members = None
+  _member_names = frozenset()
+  # Caches _get_serialization_rules, per version.
+  _serialization_rules = None
   text = None
 
   def __init__(self, text=None, *args, **kwargs):
-    if ('_members' not in self.__class__.__dict__
-        or self.__class__._members is None):
-      self.__class__._members = tuple(self.__class__._list_xml_members())
-    for member_name, member_type in self.__class__._members:
-      if member_name in kwargs:
-        setattr(self, member_name, kwargs[member_name])
-      else:
-        if isinstance(member_type, list):
-          setattr(self, member_name, [])
-        else:
-          setattr(self, member_name, None)
-    self._other_elements = []
-    self._other_attributes = {}
+    # Members which aren't given are left unset; see _MemberDescriptor.
+    if kwargs:
+      member_names = self.__class__._member_names
+      for member_name, value in kwargs.iteritems():
+        if member_name in member_names:
+          setattr(self, member_name, value)
     if text is not None:
       self.text = text
 
@@ -90,13 +207,8 @@ class XmlElement(object):
     """
     members = []
     for pair in inspect.getmembers(cls):
-      if not pair[0].startswith('_') and pair[0] != 'text':
-        member_type = pair[1]
-        if (isinstance(member_type, tuple) or isinstance(member_type, list)
-            or isinstance(member_type, (str, unicode))
-            or (inspect.isclass(member_type)
-                and issubclass(member_type, XmlElement))):
-          members.append(pair)
+      if _is_member_definition(pair[0], pair[1]):
+        members.append(pair)
     return members
 
   _list_xml_members = classmethod(_list_xml_members)
@@ -206,9 +318,23 @@ class XmlElement(object):
     """
     matches = []
     ignored1, elements, ignored2 = self.__class__._get_rules(version)
-    if elements:
+    values = self.__dict__
+    if tag is not None and namespace:
+      # Only one qname can match, so look up the member for it rather than
+      # checking every member. Extension elements can be changed in place,
+      # so they are still all checked.
+      qname = '{%s}%s' % (namespace, tag)
+      if elements and qname in elements:
+        element_def = elements[qname]
+        member = values.get(element_def[0])
+        if member:
+          if element_def[2]:
+            matches.extend(member)
+          else:
+            matches.append(member)
+    elif elements:
       for qname, element_def in elements.iteritems():
-        member = getattr(self, element_def[0])
+        member = values.get(element_def[0])
         if member:
           if _qname_matches(tag, namespace, qname):
             if element_def[2]:
@@ -217,7 +343,7 @@ class XmlElement(object):
               matches.extend(member)
             else:
               matches.append(member)
-    for element in self._other_elements:
+    for element in values.get('_other_elements', _NO_ELEMENTS):
       if _qname_matches(tag, namespace, element._qname):
         matches.append(element)
     return matches
@@ -251,26 +377,45 @@ class XmlElement(object):
       A list of XmlAttribute objects for the matching attributes.
     """
     matches = []
+    values = self.__dict__
     ignored1, ignored2, attributes = self.__class__._get_rules(version)
+    if tag is not None and namespace:
+      # As in get_elements, only one qname can match.
+      qname = '{%s}%s' % (namespace, tag)
+      if attributes and qname in attributes:
+        attribute_def = attributes[qname]
+        if isinstance(attribute_def, (list, tuple)):
+          attribute_def = attribute_def[0]
+        member = values.get(attribute_def)
+        if member:
+          matches.append(XmlAttribute(qname, member))
+      if qname in values.get('_other_attributes', _NO_ATTRIBUTES):
+        matches.append(XmlAttribute(qname, values['_other_attributes'][qname]))
+      return matches
     if attributes:
       for qname, attribute_def in attributes.iteritems():
         if isinstance(attribute_def, (list, tuple)):
           attribute_def = attribute_def[0]
-        member = getattr(self, attribute_def)
+        member = values.get(attribute_def)
         # TODO: ensure this hasn't broken existing behavior.
         #member = getattr(self, attribute_def[0])
         if member:
           if _qname_matches(tag, namespace, qname):
             matches.append(XmlAttribute(qname, member))
-    for qname, value in self._other_attributes.iteritems():
+    for qname, value in values.get('_other_attributes',
+                                   _NO_ATTRIBUTES).iteritems():
       if _qname_matches(tag, namespace, qname):
         matches.append(XmlAttribute(qname, value))
     return matches
 
   GetAttributes = get_attributes
 
-  def _harvest_tree(self, tree, version=1):
-    """Populates object members from the data in the tree Element."""
+  def _harvest_tree(self, tree, version=1, lazy=False):
+    """Populates object members from the data in the tree Element.
+
+    If lazy is True, the child objects are created in lazy mode (see
+    parse) rather than converted right away.
+    """
     qname, elements, attributes = self.__class__._get_rules(version)
     for element in tree:
       if elements and element.tag in elements:
@@ -281,13 +426,13 @@ class XmlElement(object):
           if getattr(self, definition[0]) is None:
             setattr(self, definition[0], [])
           getattr(self, definition[0]).append(_xml_element_from_tree(element,
-              definition[1], version))
+              definition[1], version, lazy))
         else:
           setattr(self, definition[0], _xml_element_from_tree(element,
-              definition[1], version))
+              definition[1], version, lazy))
       else:
         self._other_elements.append(_xml_element_from_tree(element, XmlElement,
-                                                           version))
+                                                           version, lazy))
     for attrib, value in tree.attrib.iteritems():
       if attributes and attrib in attributes:
         setattr(self, attributes[attrib], value)
@@ -316,10 +461,11 @@ class XmlElement(object):
     """
     qname, elements, attributes = self.__class__._get_rules(version)
     encoding = encoding or STRING_ENCODING
+    values = self.__dict__
     # Add the expected elements and attributes to the tree.
     if elements:
       for tag, element_def in elements.iteritems():
-        member = getattr(self, element_def[0])
+        member = values.get(element_def[0])
         # If this is a repeating element and there are members in the list.
         if member and element_def[2]:
           for instance in member:
@@ -328,13 +474,14 @@ class XmlElement(object):
           member._become_child(tree, version)
     if attributes:
       for attribute_tag, member_name in attributes.iteritems():
-        value = getattr(self, member_name)
+        value = values.get(member_name)
         if value:
           tree.attrib[attribute_tag] = value
     # Add the unexpected (other) elements and attributes to the tree.
-    for element in self._other_elements:
+    for element in values.get('_other_elements', _NO_ELEMENTS):
       element._become_child(tree, version)
-    for key, value in self._other_attributes.iteritems():
+    for key, value in values.get('_other_attributes',
+                                 _NO_ATTRIBUTES).iteritems():
       # I'm not sure if unicode can be used in the attribute name, so for now
       # we assume the encoding is correct for the attribute name.
       if not isinstance(value, unicode):
@@ -346,10 +493,38 @@ class XmlElement(object):
       else:
         tree.text = self.text.decode(encoding)
 
+  def _get_serialization_rules(cls, version):
+    """Returns the rules used by the direct XML writer for this class.
+
+    The result is a tuple (direct, elements, attributes), where direct is
+    False if the class changes how it is converted to a tree (in which case
+    the tree has to be built), elements is a list of (member_name,
+    repeating) pairs and attributes is a list of (attribute_qname,
+    member_name) pairs, both in the order _attach_members uses.
+    """
+    if cls.__dict__.get('_serialization_rules') is None:
+      type.__setattr__(cls, '_serialization_rules', {})
+    rules = cls._serialization_rules.get(version)
+    if rules is None:
+      ignored, elements, attributes = cls._get_rules(version)
+      direct = (
+          cls._to_tree.im_func is XmlElement._to_tree.im_func
+          and cls._attach_members.im_func is XmlElement._attach_members.im_func
+          and cls._become_child.im_func is XmlElement._become_child.im_func)
+      rules = (direct,
+               [(d[0], d[2]) for d in (elements or {}).itervalues()],
+               (attributes or {}).items())
+      cls._serialization_rules[version] = rules
+    return rules
+
+  _get_serialization_rules = classmethod(_get_serialization_rules)
+
   def to_string(self, version=1, encoding=None, pretty_print=None):
     """Converts this object to XML."""
-
-    tree_string = ElementTree.tostring(self._to_tree(version, encoding))
+    pieces = []
+    if not _write_xml(self, pieces.append, version, encoding):
+      pieces = [ElementTree.tostring(self._to_tree(version, encoding))]
+    tree_string = ''.join(pieces)
 
     if pretty_print and xmlString is not None:
         return xmlString(tree_string).toprettyxml()
@@ -358,6 +533,23 @@ class XmlElement(object):
  
   ToString = to_string
 
+  def write_xml(self, stream, version=1, encoding=None):
+    """Writes this object as XML to a file-like object.
+
+    The XML is the same as to_string would return, but where possible it
+    is written out piece by piece as the object graph is walked, rather
+    than being built up as one string first.
+
+    Args:
+      stream: An object with a write method, such as a file or StringIO.
+      version: int (optional) The version of the XML rules to use.
+      encoding: str (optional) The character encoding of str members.
+    """
+    if not _write_xml(self, stream.write, version, encoding):
+      stream.write(ElementTree.tostring(self._to_tree(version, encoding)))
+
+  WriteXml = write_xml
+
   def __str__(self):
     return self.to_string()
 
@@ -436,14 +628,125 @@ class XmlElement(object):
   attributes = extension_attributes
 
 
-def _get_qname(element, version):
-  if isinstance(element._qname, tuple):
-    if version <= len(element._qname):
-      return element._qname[version-1]
+class _NotDirectlySerializable(Exception):
+  pass
+
+
+def _write_xml(element, write, version, encoding):
+  """Writes element as XML by calling write with each piece of the output.
+
+  This produces exactly what ElementTree.tostring(element._to_tree(...))
+  would, without building the tree. Returns False (having written nothing)
+  if that isn't possible, because the ElementTree serializer is not one
+  this reproduces or because some class in the object graph converts
+  itself to a tree in its own way.
+  """
+  if _ElementTreeSerializer is None:
+    return False
+  # Like ElementTree, assign namespace prefixes in document order, which
+  # needs a first pass over everything since they're all declared on the
+  # root element. That pass also gathers each element's attributes and
+  # text, so the second pass only writes.
+  qnames = {None: None}
+  namespaces = {}
+  namespace_map = _ElementTreeSerializer._namespace_map
+  def add_qname(qname):
+    if qname[:1] == '{':
+      uri, tag = qname[1:].rsplit('}', 1)
+      prefix = namespaces.get(uri)
+      if prefix is None:
+        prefix = namespace_map.get(uri)
+        if prefix is None:
+          prefix = 'ns%d' % len(namespaces)
+        if prefix != 'xml':
+          namespaces[uri] = prefix
+      if prefix:
+        qnames[qname] = ('%s:%s' % (prefix, tag)).encode('us-ascii')
+      else:
+        qnames[qname] = tag.encode('us-ascii')
     else:
-      return element._qname[-1]
+      qnames[qname] = qname.encode('us-ascii')
+  try:
+    node = _gather_node(element, version, encoding or STRING_ENCODING,
+                        qnames, add_qname)
+  except _NotDirectlySerializable:
+    return False
+  _write_node(write, node, qnames, namespaces)
+  return True
+
+
+def _gather_node(element, version, encoding, qnames, add_qname):
+  """Collects (tag, attributes, text, children) for element and its
+  descendants, the way _attach_members would put them in a tree."""
+  direct, element_rules, attribute_rules = (
+      element.__class__._get_serialization_rules(version))
+  if not direct:
+    raise _NotDirectlySerializable()
+  values = element.__dict__
+  tag = _get_qname(element, version)
+  if tag is not None and tag not in qnames:
+    add_qname(tag)
+  children = []
+  for member_name, repeating in element_rules:
+    member = values.get(member_name)
+    if member and repeating:
+      children.extend(member)
+    elif member:
+      children.append(member)
+  children.extend(values.get('_other_elements', _NO_ELEMENTS))
+  attrib = {}
+  for attribute_tag, member_name in attribute_rules:
+    value = values.get(member_name)
+    if value:
+      attrib[attribute_tag] = value
+  for key, value in values.get('_other_attributes',
+                               _NO_ATTRIBUTES).iteritems():
+    if not isinstance(value, unicode):
+      value = value.decode(encoding)
+    attrib[key] = value
+  for key in attrib:
+    if key not in qnames:
+      add_qname(key)
+  text = element.text
+  if text and not isinstance(text, unicode):
+    text = text.decode(encoding)
+  # Children are attached by _become_child, which uses the default encoding.
+  return (tag, attrib, text,
+          [_gather_node(child, version, STRING_ENCODING, qnames, add_qname)
+           for child in children])
+
+
+def _write_node(write, node, qnames, namespaces):
+  escape_cdata = _ElementTreeSerializer._escape_cdata
+  escape_attrib = _ElementTreeSerializer._escape_attrib
+  tag, attrib, text, children = node
+  tag = qnames[tag]
+  if tag is None:
+    if text:
+      write(escape_cdata(text, 'us-ascii'))
+    for child in children:
+      _write_node(write, child, qnames, None)
+    return
+  write('<' + tag)
+  items = attrib.items()
+  if items or namespaces:
+    if namespaces:
+      for uri, prefix in sorted(namespaces.items(), key=lambda x: x[1]):
+        if prefix:
+          prefix = ':' + prefix
+        write(' xmlns%s="%s"' % (prefix.encode('us-ascii'),
+                                 escape_attrib(uri, 'us-ascii')))
+    for key, value in sorted(items):
+      write(' %s="%s"' % (qnames[key], escape_attrib(value, 'us-ascii')))
+  if text or children:
+    write('>')
+    if text:
+      write(escape_cdata(text, 'us-ascii'))
+    for child in children:
+      _write_node(write, child, qnames, None)
+    write('</' + tag + '>')
   else:
-    return element._qname
+    write(' />')
 
 
 def _qname_matches(tag, namespace, qname):
@@ -493,7 +796,8 @@ def _qname_matches(tag, namespace, qname):
           and member_namespace is None))
 
 
-def parse(xml_string, target_class=None, version=1, encoding=None):
+def parse(xml_string, target_class=None, version=1, encoding=None,
+          lazy=False):
   """Parses the XML string according to the rules for the target_class.
 
   Args:
@@ -504,6 +808,12 @@ def parse(xml_string, target_class=None, version=1, encoding=None):
         converting the XML into an object. The default is 1.
     encoding: str (optional) The character encoding of the bytes in the
         xml_string. Default is 'UTF-8'.
+    lazy: boolean (optional) If True, each object keeps its ElementTree node
+        and only converts it into members the first time one of its
+        attributes is used, so a caller who reads entry.title and entry.id
+        from a large feed doesn't pay for converting everything else. The
+        objects behave exactly like eagerly parsed ones. The default is
+        False.
   """
   if target_class is None:
     target_class = XmlElement
@@ -513,7 +823,7 @@ def parse(xml_string, target_class=None, version=1, encoding=None):
     else:
       xml_string = xml_string.encode(encoding)
   tree = ElementTree.fromstring(xml_string)
-  return _xml_element_from_tree(tree, target_class, version)
+  return _xml_element_from_tree(tree, target_class, version, lazy)
 
 
 Parse = parse
@@ -521,8 +831,121 @@ xml_element_from_string = parse
 XmlElementFromString = xml_element_from_string
 
 
-def _xml_element_from_tree(tree, target_class, version=1):
+def parse_file(xml_file, target_class=None, version=1, lazy=False):
+  """Parses a whole XML document read from a file-like object, such as an
+  HTTP response.
+
+  The file is fed to the XML parser a block at a time, so unlike
+  parse(xml_file.read()) the raw bytes of the document are never all held
+  in memory at once. The result is the same as from parse; to handle a
+  large feed one entry at a time, see stream_parse instead.
+
+  Args:
+    xml_file: An object with a read(size) method returning str.
+    target_class, version, lazy: As for parse.
+  """
+  if target_class is None:
+    target_class = XmlElement
+  tree = ElementTree.parse(xml_file).getroot()
+  return _xml_element_from_tree(tree, target_class, version, lazy)
+
+
+ParseFile = parse_file
+
+
+class StreamParser(object):
+  """Incrementally parses a document whose bulk is a repeating child element.
+
+  Iterating over a StreamParser reads the XML from a file-like object with
+  iterparse and yields a fully built object for each repeating child of the
+  root element (the feed's entries, by default) as soon as it has been read.
+  Each child's subtree is discarded once it has been converted, so memory
+  use stays flat no matter how many entries the feed has.
+
+  Everything else in the root element (links, totalResults, etc.) is kept,
+  and once iteration has finished, the root object (with an empty list for
+  the repeating member) is available as the root attribute.
+
+  Example:
+    parser = atom.core.StreamParser(http_response, gdata.docs.data.DocList)
+    for entry in parser:
+      print entry.title.text
+    next_link = parser.root.get_next_link()
+  """
+
+  def __init__(self, stream, target_class=None, version=1,
+               member_name='entry'):
+    """Constructor for StreamParser.
+
+    Args:
+      stream: A file-like object with a read(size) method, for example an
+          httplib.HTTPResponse.
+      target_class: XmlElement or a subclass for the root element. If None
+          is specified, the XmlElement class is used.
+      version: int (optional) The version of the schema which should be used
+          when converting the XML into objects. The default is 1.
+      member_name: str (optional) The name of the repeating member of
+          target_class whose elements should be yielded. The default is
+          'entry'.
+    """
+    if target_class is None:
+      target_class = XmlElement
+    self.stream = stream
+    self.target_class = target_class
+    self.version = version
+    self.member_name = member_name
+    self.root = None
+
+  def __iter__(self):
+    ignored1, elements, ignored2 = self.target_class._get_rules(self.version)
+    member_qname = None
+    member_class = XmlElement
+    for qname, definition in (elements or {}).iteritems():
+      if definition[0] == self.member_name:
+        member_qname = qname
+        member_class = definition[1]
+        break
+    depth = 0
+    root_tree = None
+    for event, tree in ElementTree.iterparse(self.stream,
+                                             events=('start', 'end')):
+      if event == 'start':
+        if root_tree is None:
+          root_tree = tree
+        depth += 1
+        continue
+      depth -= 1
+      if depth == 1 and tree.tag == member_qname:
+        member = _xml_element_from_tree(tree, member_class, self.version)
+        # Throw away the subtree we just converted.
+        root_tree.remove(tree)
+        tree.clear()
+        yield member
+    if root_tree is not None:
+      self.root = _xml_element_from_tree(root_tree, self.target_class,
+                                         self.version)
+
+
+def stream_parse(stream, target_class=None, version=1, member_name='entry'):
+  """Returns a StreamParser over the XML read from a file-like object.
+
+  Args:
+    stream: A file-like object with a read(size) method.
+    target_class: XmlElement or a subclass for the root element.
+    version: int (optional) The version of the schema which should be used
+        when converting the XML into objects. The default is 1.
+    member_name: str (optional) The repeating member to yield objects for.
+  """
+  return StreamParser(stream, target_class, version, member_name)
+
+
+StreamParse = stream_parse
+
+
+def _xml_element_from_tree(tree, target_class, version=1, lazy=False):
   if target_class._qname is None:
+    if lazy:
+      return _lazy_class(target_class)(tree, version)
     instance = target_class()
     instance._qname = tree.tag
     instance._harvest_tree(tree, version)
@@ -531,12 +954,75 @@ def _xml_element_from_tree(tree, target_class, version=1):
   # Namespace only will be used with Google Spreadsheets rows and
   # Google Base item attributes.
   elif tree.tag == _get_qname(target_class, version):
+    if lazy:
+      return _lazy_class(target_class)(tree, version)
     instance = target_class()
     instance._harvest_tree(tree, version)
     return instance
   return None
 
 
+class _LazyXmlElement(object):
+  """Mixin for the stand-in classes used by parse(..., lazy=True).
+
+  An instance of a lazy class only holds an ElementTree node. The first
+  time any attribute is read or set, it turns itself into an ordinary
+  instance of the real class (by switching its __class__ back) and
+  harvests the node, creating its own children lazily in turn. Since
+  type(instance) is a subclass of the real class until then, isinstance
+  checks work either way. The node is harvested under a lock, so a thread
+  which touches the instance while another is harvesting it waits for the
+  finished object.
+  """
+
+  def __init__(self, tree, version):
+    object.__setattr__(self, '_lazy_state', (tree, version))
+
+  def __getattribute__(self, name):
+    _materialize(self)
+    return object.__getattribute__(self, name)
+
+  def __setattr__(self, name, value):
+    _materialize(self)
+    object.__setattr__(self, name, value)
+
+
+_materialize_lock = threading.RLock()
+
+def _materialize(instance):
+  _materialize_lock.acquire()
+  try:
+    # Another thread may have materialized the instance while this one
+    # waited.
+    target_class = getattr(type(instance), '_lazy_target', None)
+    if target_class is None:
+      return
+    tree, version = object.__getattribute__(instance, '_lazy_state')
+    # The members are filled in on a separate object and the class is
+    # switched last, since other threads read the instance without the
+    # lock as soon as it is no longer lazy.
+    built = target_class()
+    if target_class._qname is None:
+      built._qname = tree.tag
+    built._harvest_tree(tree, version, lazy=True)
+    object.__setattr__(instance, '__dict__', built.__dict__)
+    object.__setattr__(instance, '__class__', target_class)
+  finally:
+    _materialize_lock.release()
+
+
+_lazy_classes = {}
+
+def _lazy_class(target_class):
+  lazy_class = _lazy_classes.get(target_class)
+  if lazy_class is None:
+    lazy_class = type(target_class)(
+        'Lazy%s' % target_class.__name__, (_LazyXmlElement, target_class),
+        {'_lazy_target': target_class})
+    _lazy_classes[target_class] = lazy_class
+  return lazy_class
+
+
 class XmlAttribute(object):
 
   def __init__(self, qname, value):
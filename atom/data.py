@@ -173,6 +173,10 @@ class Published(Date):
   _qname = ATOM_TEMPLATE % 'published'
 
 
+def _has_href(link):
+  return bool(link.href)
+
+
 class LinkFinder(object):
   """An "interface" providing methods to find link elements
 
@@ -184,11 +188,19 @@ class LinkFinder(object):
   This class is used as a mixin in Atom entries and feeds.
   """
 
+  def _find_link(self, rel, test=None, member_name='link'):
+    """Returns the first element in a list member with the given rel which
+    passes test (a function of the element), or None."""
+    for link in getattr(self, member_name):
+      if link.rel == rel and (test is None or test(link)):
+        return link
+    return None
+
   def find_url(self, rel):
     """Returns the URL in a link with the desired rel value."""
-    for link in self.link:
-      if link.rel == rel and link.href:
-        return link.href
+    link = self._find_link(rel, _has_href)
+    if link is not None:
+      return link.href
     return None
 
   FindUrl = find_url
@@ -199,10 +211,7 @@ class LinkFinder(object):
     If you are interested in the URL instead of the link object,
     consider using find_url instead.
     """
-    for link in self.link:
-      if link.rel == rel and link.href:
-        return link
-    return None
+    return self._find_link(rel, _has_href)
 
   GetLink = get_link
 
@@ -23,7 +23,10 @@ __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
 import os
+import socket
 import StringIO
+import threading
+import time
 import urlparse
 import urllib
 import httplib
@@ -458,7 +461,17 @@ class HttpClient(object):
       uri = Uri.parse_uri(uri)
 
     connection = self._get_connection(uri, headers=headers)
+    return self._send_request(connection, method, uri, headers, body_parts)
 
+  def _send_request(self, connection, method, uri, headers=None,
+                    body_parts=None):
+    """Sends an HTTP request over an open connection, returns the response.
+
+    Args:
+      connection: An httplib.HTTPConnection (or HTTPSConnection).
+      method, headers, body_parts: As for _http_request.
+      uri: atom.http_core.Uri
+    """
     if self.debug:
       connection.debuglevel = 1
 
@@ -497,6 +510,179 @@ class HttpClient(object):
     return connection.getresponse()
 
 
+class PooledHttpClient(HttpClient):
+  """Performs HTTP requests using httplib, reusing keep-alive connections.
+
+  Open connections are kept in a pool keyed by (scheme, host, port) once
+  their response has been read in full, so that a series of requests to
+  the same server (the pages of a feed, the chunks of a resumable upload)
+  doesn't need a new TCP connection and TLS handshake each time.
+  Connections idle for longer than max_idle_time seconds are closed
+  rather than reused, and at most max_pool_size idle connections are kept
+  in total. If a pooled connection turns out to have been closed by the
+  server, an idempotent request (see IDEMPOTENT_METHODS) is transparently
+  sent again on a new connection, unless its body was read from a file,
+  which can't be sent twice. Other requests, such as POSTs, may already
+  have been acted on by the server, so the error is raised instead.
+
+  A single PooledHttpClient may be shared between threads, and can be
+  passed as the http_client of an AtomPubClient or GDClient. Like
+  HttpClient, it does not use the http_proxy or https_proxy settings.
+  """
+  max_pool_size = 10
+  max_idle_time = 60
+  IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+  def __init__(self, max_pool_size=None, max_idle_time=None):
+    if max_pool_size is not None:
+      self.max_pool_size = max_pool_size
+    if max_idle_time is not None:
+      self.max_idle_time = max_idle_time
+    # Maps (scheme, host, port) to a list of (connection, time returned)
+    # pairs, most recently returned last.
+    self._pool = {}
+    self._pool_size = 0
+    self._lock = threading.Lock()
+
+  def _http_request(self, method, uri, headers=None, body_parts=None):
+    if isinstance(uri, (str, unicode)):
+      uri = Uri.parse_uri(uri)
+    key = _pool_key(uri)
+    connection = self._checkout(key)
+    if connection is not None:
+      try:
+        response = self._send_request(connection, method, uri, headers,
+                                      body_parts)
+        return _PooledResponse(response, self, key, connection)
+      except (httplib.HTTPException, socket.error):
+        # The server probably closed the connection while it was idle.
+        connection.close()
+        if (method not in self.IDEMPOTENT_METHODS
+            or not _can_resend(body_parts)):
+          raise
+    connection = self._get_connection(uri, headers=headers)
+    response = self._send_request(connection, method, uri, headers,
+                                  body_parts)
+    return _PooledResponse(response, self, key, connection)
+
+  def _checkout(self, key):
+    """Returns an idle connection for key from the pool, or None."""
+    expired = []
+    connection = None
+    self._lock.acquire()
+    try:
+      idle = self._pool.get(key)
+      now = time.time()
+      while idle:
+        candidate, returned = idle.pop()
+        self._pool_size -= 1
+        if now - returned > self.max_idle_time:
+          expired.append(candidate)
+        else:
+          connection = candidate
+          break
+      # Anything older than an expired connection is expired too.
+      if idle and connection is None:
+        expired.extend([pair[0] for pair in idle])
+        self._pool_size -= len(idle)
+        del idle[:]
+    finally:
+      self._lock.release()
+    for candidate in expired:
+      candidate.close()
+    return connection
+
+  def _checkin(self, key, connection):
+    """Returns a connection whose response has been read to the pool."""
+    self._lock.acquire()
+    try:
+      if self._pool_size < self.max_pool_size:
+        self._pool.setdefault(key, []).append((connection, time.time()))
+        self._pool_size += 1
+        return
+    finally:
+      self._lock.release()
+    connection.close()
+
+  def close(self):
+    """Closes all idle connections."""
+    self._lock.acquire()
+    try:
+      pool = self._pool
+      self._pool = {}
+      self._pool_size = 0
+    finally:
+      self._lock.release()
+    for idle in pool.itervalues():
+      for connection, returned in idle:
+        connection.close()
+
+  Close = close
+
+
+def _pool_key(uri):
+  port = uri.port
+  if not port:
+    if uri.scheme == 'https':
+      port = 443
+    else:
+      port = 80
+  return (uri.scheme, uri.host, int(port))
+
+
+def _can_resend(body_parts):
+  """Returns True if body_parts can be sent again, ie. none of them are
+  file-like objects which have already been read."""
+  for part in body_parts or ():
+    if hasattr(part, 'read'):
+      return False
+  return True
+
+
+class _PooledResponse(object):
+  """Wraps an httplib.HTTPResponse from a PooledHttpClient.
+
+  Once the body has been read completely the connection is handed back to
+  the pool (unless the server said it would close it). Everything else is
+  passed through to the wrapped response.
+  """
+
+  def __init__(self, response, client, key, connection):
+    self._response = response
+    self._client = client
+    self._key = key
+    self._connection = connection
+    self._check_done()
+
+  def read(self, amt=None):
+    if amt is None:
+      data = self._response.read()
+    else:
+      data = self._response.read(amt)
+    self._check_done()
+    return data
+
+  def close(self):
+    self._response.close()
+    if self._connection is not None:
+      # The rest of the body may still be in the socket, so it can't be
+      # reused.
+      self._connection.close()
+      self._connection = None
+
+  def _check_done(self):
+    if self._connection is not None and self._response.isclosed():
+      connection = self._connection
+      self._connection = None
+      if self._response.will_close:
+        connection.close()
+      else:
+        self._client._checkin(self._key, connection)
+
+  def __getattr__(self, name):
+    return getattr(self._response, name)
+
+
 def _send_data_part(data, connection):
   if isinstance(data, (str, unicode)):
     # I might want to just allow str, not unicode.
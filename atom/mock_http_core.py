@@ -22,7 +22,7 @@ __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
 import StringIO
-import pickle
+import cPickle
 import os.path
 import tempfile
 import atom.http_core
@@ -53,6 +53,16 @@ class MockHttpClient(object):
     self._recordings = recordings or []
     if real_client is not None:
       self.real_client = real_client
+    # Recordings by _recording_key, see _index_recordings.
+    self._index = {}
+    self._indexed = 0
+    self._indexed_recordings = None
+    # The session file while recordings are still being read from it.
+    self._recording_file = None
+    # The path of the last session file loaded or saved, and how many of the
+    # recordings are already in it.
+    self._saved_path = None
+    self._saved = 0
 
   def add_response(self, http_request, status, reason, headers=None,
       body=None):
@@ -74,9 +84,9 @@ class MockHttpClient(object):
     _scrub_request(request)
     if self.real_client is None:
       self.last_request_was_live = False
-      for recording in self._recordings:
-        if _match_request(recording[0], request):
-          return recording[1]
+      recording = self._find_recording(request)
+      if recording is not None:
+        return recording[1]._copy()
     else:
       # Pass along the debug settings to the real client.
       self.real_client.debug = self.debug
@@ -89,26 +99,110 @@ class MockHttpClient(object):
                         dict(atom.http_core.get_headers(scrubbed_response)),
                         scrubbed_response.read())
       # Return the recording which we just added.
-      return self._recordings[-1][1]
+      return self._recordings[-1][1]._copy()
     raise NoRecordingFound('No recoding was found for request: %s %s' % (
         request.method, str(request.uri)))
 
   Request = request
 
+  def _find_recording(self, request):
+    """Returns the first recording which matches the request, or None.
+
+    Only the recordings with the same _recording_key are looked at, and
+    recordings are read from the session file just until one matches.
+    """
+    key = _recording_key(request)
+    while True:
+      self._index_recordings()
+      for recording in self._index.get(key, ()):
+        # This is the host check from _match_request, the rest of which is
+        # covered by the key.
+        if (recording[0].uri.host is None
+            or recording[0].uri.host == request.uri.host):
+          return recording
+      if not self._read_recordings():
+        return None
+
+  def _index_recordings(self):
+    """Adds recordings appended since the last call to the index.
+
+    The index maps _recording_key to the recordings with that key, in the
+    order they were recorded. It is rebuilt if _recordings was replaced or
+    shortened.
+    """
+    if (self._recordings is not self._indexed_recordings
+        or len(self._recordings) < self._indexed):
+      self._index = {}
+      self._indexed = 0
+      self._indexed_recordings = self._recordings
+    for recording in self._recordings[self._indexed:]:
+      self._index.setdefault(_recording_key(recording[0]), []).append(
+          recording)
+    self._indexed = len(self._recordings)
+
+  def _read_recordings(self):
+    """Reads the next record from the session file into the recordings.
+
+    Returns False if there is nothing left to read.
+    """
+    if self._recording_file is None:
+      return False
+    try:
+      record = cPickle.load(self._recording_file)
+    except EOFError:
+      self._recording_file.close()
+      self._recording_file = None
+      return False
+    # Files written before recordings were appended one at a time hold a
+    # single list of all of them.
+    if isinstance(record, list):
+      self._recordings.extend(record)
+    else:
+      self._recordings.append(record)
+    self._saved = len(self._recordings)
+    return True
+
+  def _read_all_recordings(self):
+    while self._read_recordings():
+      pass
+
   def _save_recordings(self, filename):
-    recording_file = open(os.path.join(tempfile.gettempdir(), filename),
-                          'wb')
-    pickle.dump(self._recordings, recording_file)
+    """Appends the recordings which are not yet in the session file.
+
+    Each recording is pickled separately, so the file can be read back one
+    recording at a time.
+    """
+    self._read_all_recordings()
+    full_path = os.path.join(tempfile.gettempdir(), filename)
+    if full_path != self._saved_path or not os.path.exists(full_path):
+      # Some other file, write all of the recordings in place of it.
+      self._saved_path = full_path
+      self._saved = 0
+      recording_file = open(full_path, 'wb')
+    else:
+      recording_file = open(full_path, 'ab')
+    for recording in self._recordings[self._saved:]:
+      cPickle.dump(recording, recording_file, cPickle.HIGHEST_PROTOCOL)
     recording_file.close()
+    self._saved = len(self._recordings)
 
   def _load_recordings(self, filename):
-    recording_file = open(os.path.join(tempfile.gettempdir(), filename),
-                          'rb')
-    self._recordings = pickle.load(recording_file)
-    recording_file.close()
+    """Opens the session file, recordings are read as they are needed."""
+    if self._recording_file is not None:
+      self._recording_file.close()
+    self._saved_path = os.path.join(tempfile.gettempdir(), filename)
+    self._recording_file = open(self._saved_path, 'rb')
+    self._recordings = []
+    self._saved = 0
 
   def _delete_recordings(self, filename):
     full_path = os.path.join(tempfile.gettempdir(), filename)
+    if full_path == self._saved_path:
+      if self._recording_file is not None:
+        self._recording_file.close()
+        self._recording_file = None
+      self._saved_path = None
+      self._saved = 0
     if os.path.exists(full_path):
       os.remove(full_path)
 
@@ -167,6 +261,7 @@ class MockHttpClient(object):
     output = 'MockHttpClient\n  real_client: %s\n  cache file name: %s\n' % (
         self.real_client, self.get_cache_file_name())
     output += '  recordings:\n'
+    self._read_all_recordings()
     i = 0
     for recording in self._recordings:
       output += '    recording %i is for: %s %s\n' % (
@@ -175,6 +270,20 @@ class MockHttpClient(object):
     return output
 
 
+def _recording_key(http_request):
+  """The parts of a request which _match_request compares exactly.
+
+  These are the method, the URL path and the gsessionid query parameter (if
+  any). The host is left out since a recording without a host matches any.
+  """
+  query = http_request.uri.query
+  if 'gsessionid' in query:
+    gsessionid = (query['gsessionid'],)
+  else:
+    gsessionid = None
+  return (http_request.method, http_request.uri.path, gsessionid)
+
+
 def _match_request(http_request, stored_request):
   """Determines whether a request is similar enough to a stored request
      to cause the stored response to be returned."""
@@ -304,6 +413,8 @@ class SettableHttpClient(object):
 
 
 class MockHttpResponse(atom.http_core.HttpResponse):
+  # Position of the next read(amt) in the body.
+  _offset = 0
 
   def __init__(self, status=None, reason=None, headers=None, body=None):
     self._headers = headers or {}
@@ -319,5 +430,20 @@ class MockHttpResponse(atom.http_core.HttpResponse):
       else:
         self._body = body
 
-  def read(self):
-    return self._body
+  def read(self, amt=None):
+    # Reading without a size always returns the whole body, so that reads
+    # can be repeated.
+    if amt is None:
+      return self._body
+    chunk = self._body[self._offset:self._offset + amt]
+    self._offset += len(chunk)
+    return chunk
+
+  def _copy(self):
+    """Returns a new response with the same status, headers and body.
+
+    MockHttpClient hands out copies of its recorded responses, so that
+    reading one a block at a time doesn't use up the recording.
+    """
+    return MockHttpResponse(self.status, self.reason, self._headers.copy(),
+                            getattr(self, '_body', None))
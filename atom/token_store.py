@@ -39,6 +39,9 @@ class TokenStore(object):
   """Manages Authorization tokens which will be sent in HTTP headers."""
   def __init__(self, scoped_tokens=None):
     self._tokens = scoped_tokens or {}
+    # Built from _tokens by find_token, and thrown away whenever _tokens
+    # changes. See _build_index.
+    self._index = None
 
   def add_token(self, token):
     """Adds a new token to the store (replaces tokens with the same scope).
@@ -58,6 +61,7 @@ class TokenStore(object):
 
     for scope in token.scopes:
       self._tokens[str(scope)] = token
+    self._index = None
     return True  
 
   def find_token(self, url):
@@ -65,9 +69,11 @@ class TokenStore(object):
 
     Args:
       url: str or atom.url.Url or a list containing the same.
-          The URL which is going to be requested. All
-          tokens are examined to see if any scopes begin match the beginning
-          of the URL. The first match found is returned.
+          The URL which is going to be requested. Tokens whose scopes
+          have the same host as the URL and a path which begins the URL's
+          path are tried longest path first, and the first one which is
+          valid_for_scope is returned. Tokens for SCOPE_ALL, or for scopes
+          without a host, are only tried if none of those match.
 
     Returns:
       The token object which should execute the HTTP request. If there was
@@ -80,17 +86,49 @@ class TokenStore(object):
       return None
     if isinstance(url, (str, unicode)):
       url = atom.url.parse_url(url)
-    if url in self._tokens:
-      token = self._tokens[url]
-      if token.valid_for_scope(url):
-        return token
-      else:
-        del self._tokens[url]
-    for scope, token in self._tokens.iteritems():
+    if self._index is None:
+      self._build_index()
+    by_host, unindexed = self._index
+    if url.host in by_host:
+      paths, lengths = by_host[url.host]
+      path = url.path or ''
+      for length in lengths:
+        if length > len(path):
+          continue
+        for token in paths.get(path[:length], ()):
+          if token.valid_for_scope(url):
+            return token
+    for token in unindexed:
       if token.valid_for_scope(url):
         return token
     return atom.http_interface.GenericToken()
 
+  def _build_index(self):
+    """Indexes the stored tokens by the host and path of their scopes.
+
+    The index is a pair (by_host, unindexed). by_host maps each host to a
+    dict from scope path to the tokens with that scope, along with the
+    lengths of those paths from longest to shortest, so find_token only
+    has to look up the prefixes of a URL's path which some scope could
+    match. Scopes without a host, such as SCOPE_ALL, go in the unindexed
+    list and are checked last.
+    """
+    by_host = {}
+    unindexed = []
+    for scope, token in self._tokens.iteritems():
+      scope_url = atom.url.parse_url(scope)
+      if scope == SCOPE_ALL or not scope_url.host:
+        if token not in unindexed:
+          unindexed.append(token)
+        continue
+      paths = by_host.setdefault(scope_url.host, {})
+      paths.setdefault(scope_url.path or '', []).append(token)
+    for host, paths in by_host.iteritems():
+      lengths = list(set([len(path) for path in paths]))
+      lengths.sort(reverse=True)
+      by_host[host] = (paths, lengths)
+    self._index = (by_host, unindexed)
+
   def remove_token(self, token):
     """Removes the token from the token_store.
 
@@ -111,7 +149,10 @@ class TokenStore(object):
         token_found = True
     for scope in scopes_to_delete:
       del self._tokens[scope]
+    if token_found:
+      self._index = None
     return token_found
 
   def remove_all_tokens(self):
-    self._tokens = {} 
+    self._tokens = {}
+    self._index = None 
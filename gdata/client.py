@@ -31,13 +31,31 @@ in this module is GDClient.
 __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
+import cPickle
+import os
 import re
+import sys
+import thread
+import threading
 import atom.client
 import atom.core
+import atom.data
 import atom.http_core
 import gdata.gauth
 import gdata.data
 
+try:
+  from hashlib import md5 as _md5
+except ImportError:
+  from md5 import new as _md5
+
+
+# The number of pages of a feed which get_all_entries requests at once.
+DEFAULT_FETCH_THREADS = 4
+# The most operations which GDClient.batch sends in one batch feed. Most
+# services reject batch requests with more than 100 entries.
+BATCH_CHUNK_SIZE = 100
+
 
 class Error(Exception):
   pass
@@ -172,6 +190,16 @@ class GDClient(atom.client.AtomPubClient):
   This client is multi-version capable and can be used with Google Data API
   version 1 and version 2. The version should be specified by setting the
   api_version member to a string, either '1' or '2'.
+
+  Caching:
+
+  If the response_cache member is set to a ResponseCache (or
+  FileResponseCache), feeds and entries fetched with GET are remembered
+  along with their ETag. Fetching the same URI again with the same auth
+  token sends If-None-Match, and if the server replies 304 Not Modified the
+  remembered object is returned without downloading or parsing anything.
+  Objects returned from a ResponseCache are shared between calls, so they
+  should be treated as read only.
   """
 
   # The gsessionid is used by Google Calendar to prevent redirects.
@@ -181,6 +209,8 @@ class GDClient(atom.client.AtomPubClient):
   auth_service = None
   # URL prefixes which should be requested for AuthSub and OAuth.
   auth_scopes = None
+  # Optional ResponseCache for GET requests which are parsed into objects.
+  response_cache = None
 
   def request(self, method=None, uri=None, auth_token=None,
               http_request=None, converter=None, desired_class=None,
@@ -261,23 +291,48 @@ class GDClient(atom.client.AtomPubClient):
     # performing the HTTP request.
     #http_request = self.modify_request(http_request)
 
-    response = atom.client.AtomPubClient.request(self, method=method,
-        uri=uri, auth_token=auth_token, http_request=http_request, **kwargs)
+    full_request = self._build_request(method=method, uri=uri,
+        auth_token=auth_token, http_request=http_request, **kwargs)
+    cache_key = None
+    cached = None
+    if (self.response_cache is not None and converter is None
+        and desired_class is not None and full_request.method == 'GET'
+        and 'If-None-Match' not in full_request.headers):
+      cache_key = _response_cache_key(full_request,
+                                      auth_token or self.auth_token)
+      cached = self.response_cache.get(cache_key)
+      if cached is not None:
+        full_request.headers['If-None-Match'] = cached[0]
+    response = self.http_client.request(full_request)
     # On success, convert the response body using the desired converter
     # function if present.
     if response is None:
       return None
+    if response.status == 304 and cached is not None:
+      # Our copy is still current.
+      response.read()
+      return cached[1]
     if response.status == 200 or response.status == 201:
       if converter is not None:
         return converter(response)
       elif desired_class is not None:
+        # The body is parsed as it is read from the connection rather than
+        # being read into a string first.
         if self.api_version is not None:
-          return atom.core.parse(response.read(), desired_class,
-                                 version=get_xml_version(self.api_version))
+          result = atom.core.parse_file(
+              response, desired_class,
+              version=get_xml_version(self.api_version))
         else:
           # No API version was specified, so allow parse to
           # use the default version.
-          return atom.core.parse(response.read(), desired_class)
+          result = atom.core.parse_file(response, desired_class)
+        if cache_key is not None:
+          etag = response.getheader('ETag') or getattr(result, 'etag', None)
+          if etag:
+            self.response_cache.set(cache_key, etag, result)
+          elif cached is not None:
+            self.response_cache.delete(cache_key)
+        return result
       else:
         return response
     # TODO: move the redirect logic into the Google Calendar client once it
@@ -669,6 +724,58 @@ class GDClient(atom.client.AtomPubClient):
 
   GetNext = get_next
 
+  def get_all_entries(self, uri, auth_token=None, converter=None,
+                      desired_class=gdata.data.GDFeed,
+                      max_threads=DEFAULT_FETCH_THREADS, **kwargs):
+    """Fetches every page of a feed and returns all of the entries.
+
+    Rather than following next links one page at a time, the first page's
+    openSearch:totalResults and itemsPerPage are used to work out the
+    start-index of each of the remaining pages, which are then requested
+    concurrently by up to max_threads threads. If the server's next link
+    doesn't use start-index (some services page with opaque tokens) or the
+    first page doesn't say how many results there are, the next links are
+    followed sequentially instead.
+
+    The same client (and its http_client) is used from all of the threads;
+    atom.http_core.HttpClient, ProxiedHttpClient and PooledHttpClient are
+    all safe to use this way.
+
+    Args:
+      uri: str or atom.http_core.Uri of the first page of the feed.
+      max_threads: int (optional) The largest number of pages to request at
+          once. With 1, all pages are fetched in the calling thread.
+      auth_token, converter, desired_class, kwargs: As for get_feed.
+
+    Returns:
+      A list of the entries from every page, in feed order.
+    """
+    feed = self.get_feed(uri, auth_token=auth_token, converter=converter,
+                         desired_class=desired_class, **kwargs)
+    entries = list(feed.entry)
+    page_uris = _remaining_page_uris(feed)
+    if page_uris is None:
+      while feed.find_next_link() is not None:
+        feed = self.get_next(feed, auth_token=auth_token, converter=converter,
+                             desired_class=desired_class, **kwargs)
+        entries.extend(feed.entry)
+      return entries
+
+    pages = [None] * len(page_uris)
+    errors = []
+    def fetch(index):
+      pages[index] = self.get_feed(
+          page_uris[index], auth_token=auth_token, converter=converter,
+          desired_class=desired_class, **kwargs).entry
+    _run_in_threads(fetch, len(page_uris), max_threads, errors)
+    if errors:
+      raise errors[0][0], errors[0][1], errors[0][2]
+    for page in pages:
+      entries.extend(page)
+    return entries
+
+  GetAllEntries = get_all_entries
+
   # TODO: add a refresh method to re-fetch the entry/feed from the server
   # if it has been updated.
 
@@ -743,14 +850,336 @@ class GDClient(atom.client.AtomPubClient):
 
   Delete = delete
 
-  #TODO: implement batch requests.
-  #def batch(feed, uri, auth_token=None, converter=None, **kwargs):
-  #  pass
+  def batch(self, operations, uri, auth_token=None,
+            desired_class=gdata.data.BatchFeed, chunk_size=BATCH_CHUNK_SIZE,
+            max_threads=1, **kwargs):
+    """Performs a list of operations using as few batch requests as possible.
+
+    The operations are split into batch feeds of at most chunk_size entries
+    which are POSTed to the service's batch URL, up to max_threads at a
+    time. See http://code.google.com/apis/gdata/batch.html
+
+    Each operation's batch ID is set to its position in the operations list
+    (replacing any ID it already had) so that the server's responses can
+    be matched up with it.
+
+    Args:
+      operations: list of operations, each of which is either a
+          gdata.data.BatchEntry whose batch_operation has been set, or a
+          (operation, entry_or_url) pair, where operation is one of
+          gdata.data.BATCH_INSERT, BATCH_UPDATE, BATCH_DELETE or BATCH_QUERY
+          and entry_or_url is an entry or the atom id URL of an entry.
+      uri: str or atom.http_core.Uri The batch URL, usually found with
+          feed.find_batch_link().
+      auth_token: (optional) As for request.
+      desired_class: (optional) The class of the server's response feeds.
+          The default is gdata.data.BatchFeed.
+      chunk_size: int (optional) The largest number of operations to send
+          in one request. The default is the limit most services enforce.
+      max_threads: int (optional) The number of batch requests to have in
+          flight at once. The default sends them one after another.
+      kwargs: Other parameters to pass to self.post().
+
+    Returns:
+      A list with one item for each operation, in the same order: the
+      entry from the response feed describing its result (see its
+      batch_status member), or None if the server didn't process it
+      (because the batch was interrupted, for example).
+
+    Raises:
+      Whatever error stopped a batch request, such as a RequestError. The
+      chunks which were not sent yet are skipped, but others may already
+      have been applied, so the error has a batch_results member: the
+      list which would have been returned, with None for the operations
+      which got no response.
+    """
+    entries = []
+    for index, operation in enumerate(operations):
+      if isinstance(operation, tuple):
+        operation_string, entry = operation
+      else:
+        operation_string = None
+        entry = operation
+      if isinstance(entry, (str, unicode)):
+        entry = gdata.data.BatchEntry(id=atom.data.Id(text=entry))
+      entries.append(_set_batch_members(entry, str(index), operation_string))
+
+    chunks = [entries[start:start + chunk_size]
+              for start in xrange(0, len(entries), chunk_size)]
+    results = [None] * len(entries)
+    errors = []
+    def send(index):
+      feed = gdata.data.BatchFeed(entry=chunks[index])
+      response = self.post(feed, uri, auth_token=auth_token,
+                           desired_class=desired_class, **kwargs)
+      for result in response.entry:
+        batch_id = result.batch_id
+        if batch_id is None or batch_id.text is None:
+          continue
+        try:
+          results[int(batch_id.text)] = result
+        except (ValueError, IndexError):
+          pass
+    _run_in_threads(send, len(chunks), max_threads, errors)
+    if errors:
+      error_type, error, error_traceback = errors[0]
+      try:
+        error.batch_results = results
+      except AttributeError:
+        pass
+      raise error_type, error, error_traceback
+    return results
+
+  Batch = batch
 
   # TODO: add a refresh method to request a conditional update to an entry
   # or feed.
 
 
+def _remaining_page_uris(feed):
+  """Returns a Uri for each page of the feed after the first, or None.
+
+  None is returned if the pages can't be addressed by start-index, in which
+  case the feed's next links must be followed instead.
+  """
+  next_link = feed.find_next_link()
+  if next_link is None:
+    return []
+  next_uri = atom.http_core.Uri.parse_uri(next_link)
+  if 'start-index' not in next_uri.query:
+    return None
+  try:
+    total = int(feed.total_results.text)
+    per_page = int(feed.items_per_page.text)
+    start = int(feed.start_index.text)
+  except (AttributeError, TypeError, ValueError):
+    return None
+  if per_page < 1:
+    return None
+  page_uris = []
+  for index in xrange(start + per_page, total + 1, per_page):
+    page_uri = atom.http_core.Uri.parse_uri(next_link)
+    page_uri.query['start-index'] = str(index)
+    page_uris.append(page_uri)
+  return page_uris
+
+
+def _run_in_threads(function, count, max_threads, errors):
+  """Calls function(i) for each i in range(count) using up to max_threads.
+
+  The first exception raised by any call stops any calls which haven't yet
+  started, and its sys.exc_info() is appended to errors.
+  """
+  if max_threads <= 1 or count <= 1:
+    try:
+      for index in xrange(count):
+        function(index)
+    except Exception:
+      errors.append(sys.exc_info())
+    return
+  lock = threading.Lock()
+  remaining = range(count - 1, -1, -1)
+  def work():
+    while True:
+      lock.acquire()
+      try:
+        if errors or not remaining:
+          return
+        index = remaining.pop()
+      finally:
+        lock.release()
+      try:
+        function(index)
+      except Exception:
+        lock.acquire()
+        try:
+          errors.append(sys.exc_info())
+        finally:
+          lock.release()
+  workers = [threading.Thread(target=work)
+             for i in xrange(min(max_threads, count))]
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+
+
+def _set_batch_members(entry, batch_id_string, operation_string=None):
+  """Gives an entry of any class the batch ID and operation to send.
+
+  Returns the entry.
+  """
+  if isinstance(entry, gdata.data.BatchEntry):
+    entry.batch_id = gdata.data.BatchId(text=batch_id_string)
+    if operation_string is not None:
+      entry.batch_operation = gdata.data.BatchOperation(type=operation_string)
+    return entry
+  # Other entry classes don't have batch members, so the batch elements are
+  # added as extension elements instead, replacing any from an earlier
+  # batch.
+  if operation_string is None:
+    for element in entry._other_elements:
+      if isinstance(element, gdata.data.BatchOperation):
+        operation_string = element.type
+  entry._other_elements = [
+      element for element in entry._other_elements
+      if not isinstance(element, (gdata.data.BatchId,
+                                  gdata.data.BatchOperation))]
+  entry._other_elements.append(gdata.data.BatchId(text=batch_id_string))
+  if operation_string is not None:
+    entry._other_elements.append(
+        gdata.data.BatchOperation(type=operation_string))
+  return entry
+
+
+def _response_cache_key(http_request, auth_token):
+  """Identifies a GET request for the purposes of a ResponseCache.
+
+  The key is made of the full request URI, the GData-Version requested and
+  the identity (not the Authorization header, which may be different for
+  every request) of the auth token, so that users never see each other's
+  data.
+  """
+  scope = []
+  if auth_token is not None:
+    scope.append(auth_token.__class__.__name__)
+    for name in ('consumer_key', 'token', 'token_string', 'requestor_id'):
+      value = getattr(auth_token, name, None)
+      if value is not None:
+        scope.append('%s=%s' % (name, value))
+  return '%s\n%s\n%s' % (
+      str(http_request.uri), http_request.headers.get('GData-Version'),
+      _md5('\n'.join(scope)).hexdigest())
+
+
+class ResponseCache(object):
+  """Remembers the most recently fetched objects and their ETags in memory.
+
+  At most max_entries objects are kept; the least recently used is
+  forgotten first. A ResponseCache may be shared by several clients and
+  threads.
+  """
+  max_entries = 100
+
+  def __init__(self, max_entries=None):
+    if max_entries is not None:
+      self.max_entries = max_entries
+    self._lock = threading.Lock()
+    self._entries = {}
+    # Circular doubly linked list of [previous, next, key] links in order
+    # of use, most recent last.
+    self._order = []
+    self._order[:] = [self._order, self._order, None]
+
+  def get(self, key):
+    """Returns (etag, object) for key, or None."""
+    self._lock.acquire()
+    try:
+      found = self._entries.get(key)
+      if found is None:
+        return None
+      link, etag, value = found
+      self._unlink(link)
+      self._append(link)
+      return etag, value
+    finally:
+      self._lock.release()
+
+  def set(self, key, etag, value):
+    self._lock.acquire()
+    try:
+      found = self._entries.get(key)
+      if found is not None:
+        link = found[0]
+        self._unlink(link)
+      else:
+        link = [None, None, key]
+      self._append(link)
+      self._entries[key] = (link, etag, value)
+      while len(self._entries) > self.max_entries:
+        oldest = self._order[1]
+        self._unlink(oldest)
+        del self._entries[oldest[2]]
+    finally:
+      self._lock.release()
+
+  def delete(self, key):
+    self._lock.acquire()
+    try:
+      found = self._entries.pop(key, None)
+      if found is not None:
+        self._unlink(found[0])
+    finally:
+      self._lock.release()
+
+  def _append(self, link):
+    last = self._order[0]
+    link[0] = last
+    link[1] = self._order
+    last[1] = link
+    self._order[0] = link
+
+  def _unlink(self, link):
+    link[0][1] = link[1]
+    link[1][0] = link[0]
+
+
+class FileResponseCache(object):
+  """Keeps fetched objects and their ETags as pickles in a directory.
+
+  Unlike ResponseCache, the objects survive from one run of a program to
+  the next, and each get returns a new copy. Nothing is ever removed
+  except by delete, so the directory should be cleaned out from time to
+  time.
+  """
+
+  def __init__(self, directory):
+    self.directory = directory
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def _path(self, key):
+    return os.path.join(self.directory, _md5(key).hexdigest())
+
+  def get(self, key):
+    """Returns (etag, object) for key, or None."""
+    try:
+      f = open(self._path(key), 'rb')
+    except IOError:
+      return None
+    try:
+      try:
+        stored_key, etag, value = cPickle.load(f)
+      except Exception:
+        # A partly written or otherwise unreadable file.
+        return None
+    finally:
+      f.close()
+    if stored_key != key:
+      return None
+    return etag, value
+
+  def set(self, key, etag, value):
+    path = self._path(key)
+    # Write to a temporary file first so that readers never see half a
+    # pickle.
+    temp_path = '%s.%d.%d' % (path, os.getpid(), thread.get_ident())
+    f = open(temp_path, 'wb')
+    try:
+      cPickle.dump((key, etag, value), f, cPickle.HIGHEST_PROTOCOL)
+    finally:
+      f.close()
+    if os.name == 'nt' and os.path.exists(path):
+      os.remove(path)
+    os.rename(temp_path, path)
+
+  def delete(self, key):
+    try:
+      os.remove(self._path(key))
+    except OSError:
+      pass
+
+
 def _add_query_param(param_string, value, http_request):
   if value:
     http_request.uri.query[param_string] = value
@@ -149,6 +149,10 @@ class MissingRequiredParameters(Error):
   pass
 
 
+def _is_html(link):
+  return link.type == 'text/html'
+
+
 class LinkFinder(atom.data.LinkFinder):
   """Mixin used in Feed and Entry classes to simplify link lookups by type.
 
@@ -158,18 +162,15 @@ class LinkFinder(atom.data.LinkFinder):
 
   def find_html_link(self):
     """Finds the first link with rel of alternate and type of text/html."""
-    for link in self.link:
-      if link.rel == 'alternate' and link.type == 'text/html':
-        return link.href
+    link = self._find_link('alternate', _is_html)
+    if link is not None:
+      return link.href
     return None
 
   FindHtmlLink = find_html_link
 
   def get_html_link(self):
-    for a_link in self.link:
-      if a_link.rel == 'alternate' and a_link.type == 'text/html':
-        return a_link
-    return None
+    return self._find_link('alternate', _is_html)
 
   GetHtmlLink = get_html_link
 
@@ -206,9 +207,7 @@ class LinkFinder(atom.data.LinkFinder):
     if acl_link:
       return acl_link
     elif hasattr(self, 'feed_link'):
-      for a_feed_link in self.feed_link:
-        if a_feed_link.rel == ACL_REL:
-          return a_feed_link
+      return self._find_link(ACL_REL, member_name='feed_link')
 
     return None
 
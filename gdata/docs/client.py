@@ -33,6 +33,9 @@ DOCLIST_FEED_URI = '/feeds/default/private/full/'
 FOLDERS_FEED_TEMPLATE = DOCLIST_FEED_URI + '%s/contents'
 ACL_FEED_TEMPLATE = DOCLIST_FEED_URI + '%s/acl'
 REVISIONS_FEED_TEMPLATE = DOCLIST_FEED_URI + '%s/revisions'
+# Number of bytes read from the server and written to disk at a time when
+# downloading a file.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
 
 class DocsClient(gdata.client.GDClient):
@@ -70,6 +73,17 @@ class DocsClient(gdata.client.GDClient):
     Returns:
       The binary file content.
 
+    Raises:
+      gdata.client.RequestError: on error response from server.
+    """
+    return self._get_file_response(uri, auth_token=auth_token,
+                                   **kwargs).read()
+
+  GetFileContent = get_file_content
+
+  def _get_file_response(self, uri, auth_token=None, **kwargs):
+    """Requests a file, returns the response without reading its body.
+
     Raises:
       gdata.client.RequestError: on error response from server.
     """
@@ -78,33 +92,37 @@ class DocsClient(gdata.client.GDClient):
       raise  gdata.client.RequestError, {'status': server_response.status,
                                          'reason': server_response.reason,
                                          'body': server_response.read()}
-    return server_response.read()
-
-  GetFileContent = get_file_content
+    return server_response
 
   def _download_file(self, uri, file_path, auth_token=None, **kwargs):
     """Downloads a file to disk from the specified URI.
 
     Note: to download a file in memory, use the GetFileContent() method.
 
+    The file is copied to disk DOWNLOAD_CHUNK_SIZE bytes at a time as it
+    arrives, so large exports don't need to fit in memory.
+
     Args:
       uri: str The full URL to download the file from.
       file_path: str The full path to save the file to.
       auth_token: (optional) gdata.gauth.ClientLoginToken, AuthSubToken, or
           OAuthToken which authorizes this client to edit the user's data.
-      kwargs: Other parameters to pass to self.get_file_content().
+      kwargs: Other parameters to pass to self.request().
 
     Raises:
       gdata.client.RequestError: on error response from server.
     """
     f = open(file_path, 'wb')
     try:
-      f.write(self.get_file_content(uri, auth_token=auth_token, **kwargs))
-    except gdata.client.RequestError, e:
+      server_response = self._get_file_response(uri, auth_token=auth_token,
+                                                 **kwargs)
+      while True:
+        chunk = server_response.read(DOWNLOAD_CHUNK_SIZE)
+        if not chunk:
+          break
+        f.write(chunk)
+    finally:
       f.close()
-      raise e
-    f.flush()
-    f.close()
 
   _DownloadFile = _download_file
 
@@ -180,14 +198,16 @@ class DocsClient(gdata.client.GDClient):
   def get_everything(self, uri=None, auth_token=None, **kwargs):
     """Retrieves the user's entire doc list.
 
-    The method makes multiple HTTP requests (by following the feed's next links)
-    in order to fetch the user's entire document list.
+    The method makes multiple HTTP requests in order to fetch the user's
+    entire document list. Where the feed can be paged by start-index the
+    pages are fetched concurrently, otherwise the feed's next links are
+    followed one at a time.
 
     Args:
       uri: str (optional) A URI to query the doclist feed with.
       auth_token: (optional) gdata.gauth.ClientLoginToken, AuthSubToken, or
           OAuthToken which authorizes this client to edit the user's data.
-      kwargs: Other parameters to pass to self.GetDocList().
+      kwargs: Other parameters to pass to self.get_all_entries().
 
     Returns:
       A list of gdata.docs.data.DocsEntry objects representing the retrieved
@@ -196,15 +216,16 @@ class DocsClient(gdata.client.GDClient):
     if uri is None:
       uri = DOCLIST_FEED_URI
 
-    feed = self.GetDocList(uri=uri, auth_token=auth_token, **kwargs)
-    entries = feed.entry
-
-    while feed.GetNextLink() is not None:
-      feed = self.GetDocList(
-          feed.GetNextLink().href, auth_token=auth_token, **kwargs)
-      entries.extend(feed.entry)
+    limit = kwargs.pop('limit', None)
+    if limit is not None:
+      if isinstance(uri, (str, unicode)):
+        uri = atom.http_core.Uri.parse_uri(uri)
+      if not 'max-results' in uri.query:
+        uri.query['max-results'] = limit
 
-    return entries
+    return self.get_all_entries(uri, auth_token=auth_token,
+                                desired_class=gdata.docs.data.DocList,
+                                **kwargs)
 
   GetEverything = get_everything
 
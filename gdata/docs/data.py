@@ -203,10 +203,7 @@ class DocsEntry(gdata.data.GDEntry):
     Returns:
       A gdata.data.FeedLink object.
     """
-    for feed_link in self.feed_link:
-      if feed_link.rel == ACL_FEEDLINK_REL:
-        return feed_link
-    return None
+    return self._find_link(ACL_FEEDLINK_REL, member_name='feed_link')
 
   GetAclFeedLink = get_acl_feed_link
 
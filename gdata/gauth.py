@@ -49,6 +49,11 @@ ae_save
 import time
 import random
 import urllib
+import hmac
+try:
+  from hashlib import sha1
+except ImportError:
+  import sha as sha1
 import atom.http_core
 
 
@@ -551,18 +556,30 @@ def build_oauth_base_string(http_request, consumer_key, nonce, signaure_type,
     params['oauth_version'] = version
   if verifier is not None:
     params['oauth_verifier'] = verifier
+  return _build_oauth_base_string(http_request, _escape_oauth_params(params))
+
+
+def _escape_oauth_params(params):
+  """Maps each parameter's name to its escaped 'name=value' pair."""
+  escaped = {}
+  for key, value in params.iteritems():
+    escaped[key] = '%s=%s' % (urllib.quote(key, safe='~'),
+                              urllib.quote(value, safe='~'))
+  return escaped
+
+
+def _build_oauth_base_string(http_request, escaped_params):
+  """Generates the OAuth base string from already escaped parameters.
+
+  Args:
+    http_request: The request being made to the server.
+    escaped_params: dict mapping each parameter name to its escaped
+        'name=value' pair, as returned by _escape_oauth_params.
+  """
   # We need to get the key value pairs in lexigraphically sorted order.
-  sorted_keys = None
-  try:
-    sorted_keys = sorted(params.keys())
-  # The sorted function is not available in Python2.3 and lower
-  except NameError:
-    sorted_keys = params.keys()
-    sorted_keys.sort()
-  pairs = []
-  for key in sorted_keys:
-    pairs.append('%s=%s' % (urllib.quote(key, safe='~'),
-                            urllib.quote(params[key], safe='~')))
+  sorted_keys = escaped_params.keys()
+  sorted_keys.sort()
+  pairs = [escaped_params[key] for key in sorted_keys]
   # We want to escape /'s too, so use safe='~'
   all_parameters = urllib.quote('&'.join(pairs), safe='~')
   normailzed_host = http_request.uri.host.lower()
@@ -643,6 +660,66 @@ def generate_rsa_signature(http_request, consumer_key, rsa_key,
     return base64.encodestring(signed).replace('\n', '')
 
 
+class _OAuthSigner(object):
+  """Signs requests for one set of OAuth credentials.
+
+  The escaped OAuth parameters which are the same for every request, and
+  the HMAC keyed with the secrets (or the parsed RSA key), are worked out
+  once, so signing a request only needs to escape its query and the
+  nonce and timestamp.
+  """
+
+  def __init__(self, signature_type, consumer_key, version, next=None,
+               token=None, verifier=None, consumer_secret=None,
+               token_secret=None, rsa_key=None):
+    self.signature_type = signature_type
+    params = {'oauth_consumer_key': consumer_key,
+              'oauth_signature_method': signature_type}
+    if next is not None:
+      params['oauth_callback'] = str(next)
+    if token is not None:
+      params['oauth_token'] = token
+    if version is not None:
+      params['oauth_version'] = version
+    if verifier is not None:
+      params['oauth_verifier'] = verifier
+    self.static_params = _escape_oauth_params(params)
+    if signature_type == HMAC_SHA1:
+      if token_secret is not None:
+        hash_key = '%s&%s' % (urllib.quote(consumer_secret, safe='~'),
+                              urllib.quote(token_secret, safe='~'))
+      else:
+        hash_key = '%s&' % urllib.quote(consumer_secret, safe='~')
+      self.hmac = hmac.new(hash_key, digestmod=sha1)
+    else:
+      try:
+        from tlslite.utils import keyfactory
+      except ImportError:
+        from gdata.tlslite.utils import keyfactory
+      self.private_key = keyfactory.parsePrivateKey(rsa_key)
+
+  def sign(self, http_request, timestamp, nonce):
+    """Returns the base64 encoded signature for the request."""
+    import base64
+    params = _escape_oauth_params(http_request.uri.query)
+    params.update(self.static_params)
+    params['oauth_nonce'] = 'oauth_nonce=%s' % urllib.quote(nonce, safe='~')
+    params['oauth_timestamp'] = 'oauth_timestamp=%s' % urllib.quote(
+        str(timestamp), safe='~')
+    base_string = _build_oauth_base_string(http_request, params)
+    if self.signature_type == HMAC_SHA1:
+      hashed = self.hmac.copy()
+      hashed.update(base_string)
+      signed = hashed.digest()
+    else:
+      signed = self.private_key.hashAndSign(base_string)
+    # Python2.3 does not have base64.b64encode.
+    if hasattr(base64, 'b64encode'):
+      return base64.b64encode(signed)
+    else:
+      return base64.encodestring(signed).replace('\n', '')
+
+
 def generate_auth_header(consumer_key, timestamp, nonce, signature_type,
                          signature, version='1.0', next=None, token=None,
                          verifier=None):
@@ -974,18 +1051,46 @@ class OAuthHmacToken(object):
     """
     timestamp = str(int(time.time()))
     nonce = ''.join([str(random.randint(0, 9)) for i in xrange(15)])
-    signature = generate_hmac_signature(
-        http_request, self.consumer_key, self.consumer_secret, timestamp,
-        nonce, version='1.0', next=self.next, token=self.token,
-        token_secret=self.token_secret, verifier=self.verifier)
+    signature = self._get_signer().sign(http_request, timestamp, nonce)
     http_request.headers['Authorization'] = generate_auth_header(
-        self.consumer_key, timestamp, nonce, HMAC_SHA1, signature,
+        self.consumer_key, timestamp, nonce, self.SIGNATURE_METHOD, signature,
         version='1.0', next=self.next, token=self.token,
         verifier=self.verifier)
     return http_request
 
   ModifyRequest = modify_request
 
+  def _signer_state(self):
+    return (self.consumer_key, self.consumer_secret, self.token,
+            self.token_secret, self.next, self.verifier)
+
+  def _new_signer(self):
+    return _OAuthSigner(
+        HMAC_SHA1, self.consumer_key, '1.0', next=self.next, token=self.token,
+        verifier=self.verifier, consumer_secret=self.consumer_secret,
+        token_secret=self.token_secret)
+
+  def _get_signer(self):
+    """Returns an _OAuthSigner for the token's current credentials.
+
+    The signer is kept between requests and only replaced if one of the
+    members it depends on (the token, after an upgrade, for example) has
+    changed.
+    """
+    state = self._signer_state()
+    cached = self.__dict__.get('_signer')
+    if cached is None or cached[0] != state:
+      cached = (state, self._new_signer())
+      self._signer = cached
+    return cached[1]
+
+  def __getstate__(self):
+    # The cached signer holds hash objects, which can't be pickled or
+    # copied; it is made again on the next request.
+    state = self.__dict__.copy()
+    state.pop('_signer', None)
+    return state
+
 
 class OAuthRsaToken(OAuthHmacToken):
   SIGNATURE_METHOD = RSA_SHA1
@@ -1010,20 +1115,19 @@ class OAuthRsaToken(OAuthHmacToken):
     Returns:
       The same HTTP request object which was passed in.
     """
-    timestamp = str(int(time.time()))
-    nonce = ''.join([str(random.randint(0, 9)) for i in xrange(15)])
-    signature = generate_rsa_signature(
-        http_request, self.consumer_key, self.rsa_private_key, timestamp,
-        nonce, version='1.0', next=self.next, token=self.token,
-        token_secret=self.token_secret, verifier=self.verifier)
-    http_request.headers['Authorization'] = generate_auth_header(
-        self.consumer_key, timestamp, nonce, RSA_SHA1, signature,
-        version='1.0', next=self.next, token=self.token,
-        verifier=self.verifier)
-    return http_request
+    return OAuthHmacToken.modify_request(self, http_request)
 
   ModifyRequest = modify_request
 
+  def _signer_state(self):
+    return (self.consumer_key, self.rsa_private_key, self.token, self.next,
+            self.verifier)
+
+  def _new_signer(self):
+    return _OAuthSigner(
+        RSA_SHA1, self.consumer_key, '1.0', next=self.next, token=self.token,
+        verifier=self.verifier, rsa_key=self.rsa_private_key)
+
 
 class TwoLeggedOAuthHmacToken(OAuthHmacToken):
 
@@ -1242,6 +1346,44 @@ def find_scopes_for_services(service_names=None):
 FindScopesForServices = find_scopes_for_services
 
 
+# Tokens loaded by ae_load with cache=True, kept for the life of the process
+# as {key_name: (version, token)}. A cached token is only returned while its
+# version is current, so a token saved or deleted by any process is reloaded
+# the next time it is asked for. Only keys the caller opts in are kept, so
+# per-user tokens don't pile up here.
+_AE_TOKEN_CACHE = {}
+
+
+def _ae_version_key(key_name):
+  return ''.join((key_name, ':version'))
+
+
+def _ae_current_version(key_name):
+  """Returns the version ae_save and ae_delete last gave this token.
+
+  The version only lives in memcache. If it has been evicted or flushed, a
+  new one is seeded from the clock, so that every process reloads the token
+  once rather than trusting a copy that may be older than the flush.
+  """
+  from google.appengine.api import memcache
+  version_key = _ae_version_key(key_name)
+  version = memcache.get(version_key)
+  if version is None:
+    seed = long(time.time() * 1000)
+    if memcache.add(version_key, seed):
+      return seed
+    # Another process seeded it first.
+    version = memcache.get(version_key)
+  return version
+
+
+def _ae_bump_version(key_name):
+  from google.appengine.api import memcache
+  _AE_TOKEN_CACHE.pop(key_name, None)
+  if memcache.incr(_ae_version_key(key_name)) is None:
+    _ae_current_version(key_name)
+
+
 def ae_save(token, token_key):
   """Stores an auth token in the App Engine datastore.
 
@@ -1253,6 +1395,9 @@ def ae_save(token, token_key):
   If you are not using the Users API you are free to choose whatever
   string you would like for a token_string.
 
+  Saving a token bumps its version, so copies cached by ae_load in this and
+  other processes are replaced on their next load.
+
   Args:
     token: an auth token object. Must be one of ClientLoginToken,
            AuthSubToken, SecureAuthSubToken, OAuthRsaToken, or OAuthHmacToken
@@ -1264,21 +1409,40 @@ def ae_save(token, token_key):
   """
   import gdata.alt.app_engine
   key_name = ''.join(('gd_auth_token', token_key))
-  return gdata.alt.app_engine.set_token(key_name, token_to_blob(token))
+  result = gdata.alt.app_engine.set_token(key_name, token_to_blob(token))
+  _ae_bump_version(key_name)
+  return result
 
 
 AeSave = ae_save
 
 
-def ae_load(token_key):
+def ae_load(token_key, version=None, cache=False):
   """Retrieves a token object from the App Engine datastore.
 
   This is a convenience method for using the library with App Engine.
   See also ae_save.
 
+  If cache is True, the token is cached in the process along with the
+  version it was loaded at. While the version is unchanged the cached token
+  is returned without fetching or parsing the stored blob; the same token
+  object is returned each time, so copy it before changing it. Caching is
+  meant for the few fixed keys an application loads on most requests, such
+  as its own access token, not for per-user keys.
+
   Args:
     token_key: str The unique key associated with the desired token when it
                was saved using ae_save.
+    version: (optional) Any value which changes whenever the token may have
+             been saved or deleted, such as a counter the application already
+             reads for each request. If given, it is trusted in place of the
+             version kept by ae_save and ae_delete, and a cached token is
+             returned without any RPC. If None, the token's version is
+             looked up in memcache, which is much cheaper than loading the
+             token itself. Only used if cache is True.
+    cache: (optional) bool Whether to keep the token in the process and
+           return the kept copy while its version is unchanged. Defaults to
+           False.
 
   Returns:
     A token object if there was a token associated with the token_key or None
@@ -1286,11 +1450,24 @@ def ae_load(token_key):
   """
   import gdata.alt.app_engine
   key_name = ''.join(('gd_auth_token', token_key))
+  if not cache:
+    token_string = gdata.alt.app_engine.get_token(key_name)
+    if token_string is not None:
+      return token_from_blob(token_string)
+    return None
+  if version is None:
+    # Tagged so it can't be mistaken for a version passed in by the caller.
+    version = ('ae_save', _ae_current_version(key_name))
+  cached = _AE_TOKEN_CACHE.get(key_name)
+  if cached is not None and cached[0] == version:
+    return cached[1]
   token_string = gdata.alt.app_engine.get_token(key_name)
   if token_string is not None:
-    return token_from_blob(token_string)
+    token = token_from_blob(token_string)
   else:
-    return None
+    token = None
+  _AE_TOKEN_CACHE[key_name] = (version, token)
+  return token
 
 
 AeLoad = ae_load
@@ -1301,6 +1478,7 @@ def ae_delete(token_key):
   import gdata.alt.app_engine
   key_name = ''.join(('gd_auth_token', token_key))
   gdata.alt.app_engine.delete_token(key_name)
+  _ae_bump_version(key_name)
 
 
 AeDelete = ae_delete
@@ -26,6 +26,7 @@ __author__ = 'j.s@google.com (Jeff Scudder)'
 
 
 import gdata.client
+import gdata.data
 import gdata.gauth
 import gdata.spreadsheets.data
 import atom.data
@@ -41,6 +42,9 @@ WORKSHEET_URL = ('https://spreadsheets.google.com/feeds/worksheets/'
 TABLES_URL = 'https://spreadsheets.google.com/feeds/%s/tables'
 RECORDS_URL = 'https://spreadsheets.google.com/feeds/%s/records/%s'
 RECORD_URL = 'https://spreadsheets.google.com/feeds/%s/records/%s/%s'
+CELLS_URL = 'https://spreadsheets.google.com/feeds/cells/%s/%s/private/full'
+CELLS_BATCH_URL = ('https://spreadsheets.google.com/feeds/cells/%s/%s/'
+                   'private/full/batch')
 
 
 class SpreadsheetsClient(gdata.client.GDClient):
@@ -337,6 +341,230 @@ class SpreadsheetsClient(gdata.client.GDClient):
 
   GetRecord = get_record
 
+  def get_cells(self, spreadsheet_key, worksheet_id,
+                desired_class=gdata.spreadsheets.data.CellsFeed,
+                auth_token=None, **kwargs):
+    """Retrieves the cells in a worksheet.
+
+    Args:
+      spreadsheet_key: str, The unique ID of this containing spreadsheet. This
+                       can be the ID from the URL or as provided in a
+                       Spreadsheet entry.
+      worksheet_id: str, The unique ID for the worksheet withing the desired
+                    spreadsheet.
+      desired_class: class descended from atom.core.XmlElement to which a
+                     successful response should be converted. If there is no
+                     converter function specified (converter=None) then the
+                     desired_class will be used in calling the
+                     atom.core.parse function. If neither
+                     the desired_class nor the converter is specified, an
+                     HTTP reponse object will be returned. Defaults to
+                     gdata.spreadsheets.data.CellsFeed.
+      auth_token: An object which sets the Authorization HTTP header in its
+                  modify_request method. Recommended classes include
+                  gdata.gauth.ClientLoginToken and gdata.gauth.AuthSubToken
+                  among others. Represents the current user. Defaults to None
+                  and if None, this method will look for a value in the
+                  auth_token member of SpreadsheetsClient.
+
+    Pass a CellQuery as the q argument to limit the cells returned.
+    """
+    return self.get_feed(CELLS_URL % (spreadsheet_key, worksheet_id),
+                         desired_class=desired_class, auth_token=auth_token,
+                         **kwargs)
+
+  GetCells = get_cells
+
+  def get_range(self, spreadsheet_key, worksheet_id, min_row, min_col,
+                max_row, max_col, auth_token=None, **kwargs):
+    """Reads a rectangle of cells with a single cell feed request.
+
+    Args:
+      spreadsheet_key: str, The unique ID of this containing spreadsheet. This
+                       can be the ID from the URL or as provided in a
+                       Spreadsheet entry.
+      worksheet_id: str, The unique ID for the worksheet withing the desired
+                    spreadsheet.
+      min_row: int The first row in the range, counting from 1.
+      min_col: int The first column in the range, counting from 1.
+      max_row: int The last row in the range.
+      max_col: int The last column in the range.
+      auth_token: An object which sets the Authorization HTTP header in its
+                  modify_request method. Recommended classes include
+                  gdata.gauth.ClientLoginToken and gdata.gauth.AuthSubToken
+                  among others. Represents the current user. Defaults to None
+                  and if None, this method will look for a value in the
+                  auth_token member of SpreadsheetsClient.
+
+    Returns:
+      A CellRange holding the values of the cells. Empty cells are
+      requested too, so that any cell in the range can be written back with
+      update_range.
+    """
+    query = CellQuery(min_row=min_row, max_row=max_row, min_col=min_col,
+                      max_col=max_col, return_empty='true')
+    feed = self.get_cells(spreadsheet_key, worksheet_id,
+                          auth_token=auth_token, q=query, **kwargs)
+    return CellRange(spreadsheet_key, worksheet_id, min_row, min_col,
+                     max_row, max_col, feed.entry)
+
+  GetRange = get_range
+
+  def update_range(self, cell_range, auth_token=None, force=False,
+                   chunk_size=gdata.client.BATCH_CHUNK_SIZE, max_threads=1,
+                   **kwargs):
+    """Writes the cells changed in a CellRange using the cell batch feed.
+
+    The changed cells are sent as batch updates, chunk_size cells to a
+    request. Each update carries the ETag of the cell as it was read, so a
+    cell which someone else has changed since is not overwritten: its result
+    has a batch_status code of 409 or 412, and it stays in
+    cell_range.changed_cells(). Cells which were written are marked as
+    unchanged, and their entries replaced by the server's.
+
+    Args:
+      cell_range: CellRange, as returned by get_range.
+      auth_token: An object which sets the Authorization HTTP header in its
+                  modify_request method. Recommended classes include
+                  gdata.gauth.ClientLoginToken and gdata.gauth.AuthSubToken
+                  among others. Represents the current user. Defaults to None
+                  and if None, this method will look for a value in the
+                  auth_token member of SpreadsheetsClient.
+      force: boolean stating whether the cells should be written even if
+             they have changed since they were read. Defaults to False.
+      chunk_size: int (optional) The most cells to send in one request.
+      max_threads: int (optional) The number of batch requests to have in
+                   flight at once.
+
+    Returns:
+      A list of (row, col, result) for each cell that was sent, where result
+      is the CellEntry from the batch response (see its batch_status
+      member) or None if the server didn't process it.
+    """
+    changed = cell_range.changed_cells()
+    operations = []
+    for row, col in changed:
+      old_entry = cell_range.entry(row, col)
+      if old_entry is None:
+        raise gdata.spreadsheets.data.Error(
+            'Cell R%sC%s is not in the worksheet' % (row, col))
+      value = cell_range.get(row, col)
+      cell = gdata.spreadsheets.data.Cell(row=str(row), col=str(col))
+      if value is None or value == '':
+        # Empty attributes aren't written out, but clearing a cell needs
+        # inputValue="".
+        cell._other_attributes['inputValue'] = ''
+      elif isinstance(value, basestring):
+        cell.input_value = value
+      else:
+        cell.input_value = unicode(value)
+      entry = gdata.spreadsheets.data.CellEntry(
+          id=atom.data.Id(text=old_entry.id.text), cell=cell)
+      entry.link.append(atom.data.Link(
+          rel='edit', type='application/atom+xml',
+          href=old_entry.find_edit_link()))
+      if not force:
+        entry.etag = old_entry.etag
+      operations.append((gdata.data.BATCH_UPDATE, entry))
+    if not operations:
+      return []
+    if force:
+      kwargs['if_match'] = _IfMatch('*')
+    results = self.batch(
+        operations, CELLS_BATCH_URL % (cell_range.spreadsheet_key,
+                                       cell_range.worksheet_id),
+        auth_token=auth_token,
+        desired_class=gdata.spreadsheets.data.CellsFeed,
+        chunk_size=chunk_size, max_threads=max_threads, **kwargs)
+    for (row, col), result in zip(changed, results):
+      if (result is not None and result.batch_status is not None
+          and str(result.batch_status.code).startswith('2')):
+        cell_range._set_entry(row, col, result)
+    return [(row, col, result)
+            for (row, col), result in zip(changed, results)]
+
+  UpdateRange = update_range
+
+
+class CellRange(object):
+  """A rectangle of cells read from a worksheet by get_range.
+
+  values holds the cells' input values (what was typed into each cell, so a
+  formula rather than its result) as a list of rows, each a list of
+  strings. values[0][0] is the cell at (min_row, min_col). Empty cells hold
+  '' and cells beyond the edge of the worksheet hold None. Change values
+  directly or with set, then send the changes with update_range; setting
+  a cell to '' or None clears it, and other values such as numbers are
+  written as text.
+  """
+
+  def __init__(self, spreadsheet_key, worksheet_id, min_row, min_col,
+               max_row, max_col, entries=None):
+    self.spreadsheet_key = spreadsheet_key
+    self.worksheet_id = worksheet_id
+    self.min_row = int(min_row)
+    self.min_col = int(min_col)
+    self.max_row = int(max_row)
+    self.max_col = int(max_col)
+    rows = self.max_row - self.min_row + 1
+    cols = self.max_col - self.min_col + 1
+    self.values = [[None] * cols for i in xrange(rows)]
+    # The values as last read or written, to find the changed cells.
+    self._saved = [[None] * cols for i in xrange(rows)]
+    # The CellEntry for each cell, by (row, col) offset in values.
+    self._entries = {}
+    for entry in entries or ():
+      self._set_entry(int(entry.cell.row), int(entry.cell.col), entry)
+
+  def _set_entry(self, row, col, entry):
+    r = row - self.min_row
+    c = col - self.min_col
+    if 0 <= r < len(self.values) and 0 <= c < len(self.values[r]):
+      value = entry.cell.input_value or ''
+      self.values[r][c] = value
+      self._saved[r][c] = value
+      self._entries[(r, c)] = entry
+
+  def get(self, row, col):
+    """Returns the value of a cell, by its row and column in the worksheet."""
+    return self.values[row - self.min_row][col - self.min_col]
+
+  Get = get
+
+  def set(self, row, col, value):
+    """Changes a cell, by its row and column in the worksheet."""
+    self.values[row - self.min_row][col - self.min_col] = value
+
+  Set = set
+
+  def entry(self, row, col):
+    """Returns the CellEntry for a cell, or None if it is not in the sheet."""
+    return self._entries.get((row - self.min_row, col - self.min_col))
+
+  Entry = entry
+
+  def changed_cells(self):
+    """Lists (row, col) for each cell whose value has changed, by row."""
+    changed = []
+    for r, (row, saved_row) in enumerate(zip(self.values, self._saved)):
+      if row != saved_row:
+        for c in xrange(len(row)):
+          if row[c] != saved_row[c]:
+            changed.append((self.min_row + r, self.min_col + c))
+    return changed
+
+  ChangedCells = changed_cells
+
+
+class _IfMatch(object):
+  """Sets the If-Match header of a request, as a request keyword argument."""
+
+  def __init__(self, etag):
+    self.etag = etag
+
+  def modify_request(self, http_request):
+    http_request.headers['If-Match'] = self.etag
+
 
 class SpreadsheetQuery(gdata.client.Query):
 
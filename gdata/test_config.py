@@ -19,6 +19,7 @@ import sys
 import unittest
 import getpass
 import inspect
+import atom.core
 import atom.mock_http_core
 import gdata.gauth
 
@@ -393,6 +394,10 @@ def check_data_classes(test, classes):
                          data_class))
 
     for attribute_name, value in data_class.__dict__.iteritems():
+      # Member definitions are wrapped in descriptors by the XmlElement
+      # metaclass; check what they were declared as.
+      if isinstance(value, atom.core._MemberDescriptor):
+        value = value.definition
       # Ignore all elements that start with _ (private members)
       if not attribute_name.startswith('_'):
         try:
@@ -1,5 +1,7 @@
 """Class for caching TLS sessions."""
 
+import binascii
+import cPickle
 import thread
 import time
 
@@ -11,6 +13,13 @@ class SessionCache:
     simply pass a SessionCache instance into the server handshake
     function.
 
+    Clients can use a SessionCache too, keyed by server rather than by
+    session ID, to resume sessions across connections; see
+    L{tlslite.integration.ClientHelper.ClientHelper}.
+
+    Sessions are kept in least-recently-used order, so lookups, inserts,
+    evictions and expiry all take constant time.
+
     This class is thread-safe.
     """
 
@@ -24,8 +33,9 @@ class SessionCache:
 
         @type maxEntries: int
         @param maxEntries: The maximum size of the cache.  When this
-        limit is reached, the oldest sessions will be deleted as
-        necessary to make room for new ones.  The default is 10000.
+        limit is reached, the least recently used sessions will be
+        deleted as necessary to make room for new ones.  The default is
+        10000.
 
         @type maxAge: int
         @param maxAge:  The number of seconds before a session expires
@@ -33,21 +43,23 @@ class SessionCache:
 
         self.lock = thread.allocate_lock()
 
-        # Maps sessionIDs to sessions
+        # Maps sessionIDs to [previous, next, sessionID, session, timestamp]
+        # links in a circular list, least recently used first
         self.entriesDict = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None, None]
 
-        #Circular list of (sessionID, timestamp) pairs
-        self.entriesList = [(None,None)] * maxEntries
-
-        self.firstIndex = 0
-        self.lastIndex = 0
+        self.maxEntries = maxEntries
         self.maxAge = maxAge
 
     def __getitem__(self, sessionID):
         self.lock.acquire()
         try:
-            self._purge() #Delete old items, so we're assured of a new one
-            session = self.entriesDict[sessionID]
+            link = self.entriesDict[sessionID]
+            if time.time() - link[4] > self.maxAge:
+                self._remove(link)
+                raise KeyError()
+            session = link[3]
 
             #When we add sessions they're resumable, but it's possible
             #for the session to be invalidated later on (if a fatal alert
@@ -55,6 +67,8 @@ class SessionCache:
             #returning the session.
 
             if session.valid():
+                self._unlink(link)
+                self._append(link)
                 return session
             else:
                 raise KeyError()
@@ -65,35 +79,92 @@ class SessionCache:
     def __setitem__(self, sessionID, session):
         self.lock.acquire()
         try:
+            #Replace any existing element
+            link = self.entriesDict.get(sessionID)
+            if link is not None:
+                self._unlink(link)
+
             #Add the new element
-            self.entriesDict[sessionID] = session
-            self.entriesList[self.lastIndex] = (sessionID, time.time())
-            self.lastIndex = (self.lastIndex+1) % len(self.entriesList)
-
-            #If the cache is full, we delete the oldest element to make an
-            #empty space
-            if self.lastIndex == self.firstIndex:
-                del(self.entriesDict[self.entriesList[self.firstIndex][0]])
-                self.firstIndex = (self.firstIndex+1) % len(self.entriesList)
+            link = [None, None, sessionID, session, time.time()]
+            self._append(link)
+            self.entriesDict[sessionID] = link
+
+            #Make room and delete expired items
+            self._purge()
         finally:
             self.lock.release()
 
-    #Delete expired items
+    #Delete least recently used items while the cache is too big, and
+    #expired ones until we reach one which isn't
     def _purge(self):
         currentTime = time.time()
-
-        #Search through the circular list, deleting expired elements until
-        #we reach a non-expired element.  Since elements in list are
-        #ordered in time, we can break once we reach the first non-expired
-        #element
-        index = self.firstIndex
-        while index != self.lastIndex:
-            if currentTime - self.entriesList[index][1] > self.maxAge:
-                del(self.entriesDict[self.entriesList[index][0]])
-                index = (index+1) % len(self.entriesList)
+        while self.entriesDict:
+            oldest = self.root[1]
+            if len(self.entriesDict) > self.maxEntries or \
+                    currentTime - oldest[4] > self.maxAge:
+                self._remove(oldest)
             else:
                 break
-        self.firstIndex = index
+
+    def _remove(self, link):
+        self._unlink(link)
+        del(self.entriesDict[link[2]])
+
+    def _append(self, link):
+        last = self.root[0]
+        link[0] = last
+        link[1] = self.root
+        last[1] = link
+        self.root[0] = link
+
+    def _unlink(self, link):
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+
+class MemcacheSessionCache:
+    """A session cache kept in memcache, which can be shared by processes.
+
+    Any memcache client with get(key) and set(key, value, time) methods
+    can be used (for example a python-memcached Client, or App Engine's
+    google.appengine.api.memcache module).  Memcache takes care of
+    eviction and expiry.
+
+    Unlike L{SessionCache}, this returns copies of the sessions it was
+    given, so a session invalidated after it was added is only forgotten
+    when it expires.  Sessions which can't be pickled are not cached.
+    """
+
+    def __init__(self, client, maxAge=14400, prefix="tlslite:session:"):
+        """Create a new MemcacheSessionCache.
+
+        @type client: object
+        @param client: The memcache client.
+
+        @type maxAge: int
+        @param maxAge:  The number of seconds before a session expires
+        from the cache.  The default is 14400 (i.e. 4 hours).
+
+        @type prefix: str
+        @param prefix: Prepended to each memcache key."""
+        self.client = client
+        self.maxAge = maxAge
+        self.prefix = prefix
+
+    def _key(self, sessionID):
+        return self.prefix + binascii.hexlify(sessionID)
+
+    def __getitem__(self, sessionID):
+        session = self.client.get(self._key(sessionID))
+        if session is None or not session.valid():
+            raise KeyError()
+        return session
+
+    def __setitem__(self, sessionID, session):
+        try:
+            self.client.set(self._key(sessionID), session, self.maxAge)
+        except (TypeError, cPickle.PicklingError):
+            pass
 
 def _test():
     import doctest, SessionCache
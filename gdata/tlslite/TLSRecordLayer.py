@@ -18,6 +18,9 @@ import socket
 import errno
 import traceback
 
+#How many bytes to ask the socket for at a time when receiving records
+RECV_SIZE = 32768
+
 class _ConnectionState:
     def __init__(self):
         self.macContext = None
@@ -115,6 +118,11 @@ class TLSRecordLayer:
         self._handshakeBuffer = []
         self._readBuffer = ""
 
+        #Bytes received from the socket which haven't been made into
+        #records yet start at _recvOffset in _recvBuffer
+        self._recvBuffer = ""
+        self._recvOffset = 0
+
         #Handshake digests
         self._handshake_md5 = md5.md5()
         self._handshake_sha = sha.sha()
@@ -196,7 +204,10 @@ class TLSRecordLayer:
         @return: A generator; see above for details.
         """
         try:
-            while len(self._readBuffer)<min and not self.closed:
+            #Also decrypt any records which have already been received,
+            #since the socket won't become readable again for them
+            while (len(self._readBuffer)<min or self._hasBufferedRecord()) \
+                    and not self.closed:
                 try:
                     for result in self._getMsg(ContentType.application_data):
                         if result in (0,1):
@@ -712,42 +723,32 @@ class TLSRecordLayer:
 
         #If there's a handshake message waiting, return it
         if self._handshakeBuffer:
-            recordHeader, bytes = self._handshakeBuffer[0]
-            self._handshakeBuffer = self._handshakeBuffer[1:]
+            recordHeader, bytes = self._handshakeBuffer.pop(0)
             yield (recordHeader, Parser(bytes))
             return
 
         #Otherwise...
         #Read the next record header
-        bytes = createByteArraySequence([])
-        recordHeaderLength = 1
-        ssl2 = False
-        while 1:
-            try:
-                s = self.sock.recv(recordHeaderLength-len(bytes))
-            except socket.error, why:
-                if why[0] == errno.EWOULDBLOCK:
-                    yield 0
-                    continue
-                else:
-                    raise
-
-            #If the connection was abruptly closed, raise an error
-            if len(s)==0:
-                raise TLSAbruptCloseError()
-
-            bytes += stringToBytes(s)
-            if len(bytes)==1:
-                if bytes[0] in ContentType.all:
-                    ssl2 = False
-                    recordHeaderLength = 5
-                elif bytes[0] == 128:
-                    ssl2 = True
-                    recordHeaderLength = 2
-                else:
-                    raise SyntaxError()
-            if len(bytes) == recordHeaderLength:
+        for result in self._recvBytes(1):
+            if result in (0,1):
+                yield result
+            else:
                 break
+        firstByte = ord(result)
+        if firstByte in ContentType.all:
+            ssl2 = False
+            recordHeaderLength = 5
+        elif firstByte == 128:
+            ssl2 = True
+            recordHeaderLength = 2
+        else:
+            raise SyntaxError()
+        for result in self._recvBytes(recordHeaderLength-1):
+            if result in (0,1):
+                yield result
+            else:
+                break
+        bytes = stringToBytes(chr(firstByte) + result)
 
         #Parse the record header
         if ssl2:
@@ -761,24 +762,12 @@ class TLSRecordLayer:
                 yield result
 
         #Read the record contents
-        bytes = createByteArraySequence([])
-        while 1:
-            try:
-                s = self.sock.recv(r.length - len(bytes))
-            except socket.error, why:
-                if why[0] == errno.EWOULDBLOCK:
-                    yield 0
-                    continue
-                else:
-                    raise
-
-            #If the connection is closed, raise a socket error
-            if len(s)==0:
-                    raise TLSAbruptCloseError()
-
-            bytes += stringToBytes(s)
-            if len(bytes) == r.length:
+        for result in self._recvBytes(r.length):
+            if result in (0,1):
+                yield result
+            else:
                 break
+        bytes = stringToBytes(result)
 
         #Check the record header fields (2)
         #We do this after reading the contents from the socket, so that
@@ -840,10 +829,55 @@ class TLSRecordLayer:
 
             #We've moved at least one handshake message into the
             #handshakeBuffer, return the first one
-            recordHeader, bytes = self._handshakeBuffer[0]
-            self._handshakeBuffer = self._handshakeBuffer[1:]
+            recordHeader, bytes = self._handshakeBuffer.pop(0)
             yield (recordHeader, Parser(bytes))
 
+    def _hasBufferedRecord(self):
+        """Returns True if _recvBuffer holds a complete record."""
+        start = self._recvOffset
+        header = self._recvBuffer[start : start+5]
+        if len(header) < 5 or ord(header[0]) not in ContentType.all:
+            return False
+        length = (ord(header[3]) << 8) | ord(header[4])
+        return len(self._recvBuffer) - start >= 5 + length
+
+    def _recvBytes(self, length):
+        """Yields 0 until length bytes have been received, then yields them
+        as a string.
+
+        Each recv asks for up to RECV_SIZE bytes, so a single read from the
+        socket usually brings in several records, which are then taken from
+        _recvBuffer without copying the rest of it."""
+        while len(self._recvBuffer) - self._recvOffset < length:
+            try:
+                s = self.sock.recv(max(RECV_SIZE, length))
+            except socket.error, why:
+                if why[0] == errno.EWOULDBLOCK:
+                    yield 0
+                    continue
+                else:
+                    raise
+
+            #If the connection was abruptly closed, raise an error
+            if len(s)==0:
+                raise TLSAbruptCloseError()
+
+            if self._recvOffset:
+                self._recvBuffer = self._recvBuffer[self._recvOffset:] + s
+                self._recvOffset = 0
+            else:
+                self._recvBuffer += s
+
+        start = self._recvOffset
+        end = start + length
+        result = self._recvBuffer[start:end]
+        if end == len(self._recvBuffer):
+            self._recvBuffer = ""
+            self._recvOffset = 0
+        else:
+            self._recvOffset = end
+        yield result
+
 
     def _decryptRecord(self, recordType, bytes):
         if self._readState.encContext:
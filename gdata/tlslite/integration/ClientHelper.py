@@ -4,6 +4,8 @@ A helper class for using TLS Lite with stdlib clients
 """
 
 from gdata.tlslite.Checker import Checker
+from gdata.tlslite.X509CertChain import X509CertChain
+from gdata.tlslite.utils.cryptomath import hashAndBase64
 
 class ClientHelper:
     """This is a helper class used to integrate TLS Lite with various
@@ -15,7 +17,7 @@ class ClientHelper:
               cryptoID=None, protocol=None,
               x509Fingerprint=None,
               x509TrustList=None, x509CommonName=None,
-              settings = None):
+              settings = None, sessionCache=None):
         """
         For client authentication, use one of these argument
         combinations:
@@ -97,6 +99,13 @@ class ClientHelper:
         @param settings: Various settings which can be used to control
         the ciphersuites, certificate types, and SSL/TLS versions
         offered by the client.
+
+        @type sessionCache: L{tlslite.SessionCache.SessionCache}
+        @param sessionCache: A cache of sessions from earlier connections,
+        keyed by server and client credentials, which may be shared
+        between many helpers.  If it holds a session for the same server
+        and credentials, the handshake will try to resume it rather than
+        doing a full handshake.  Not used with shared keys.
         """
 
         self.username = None
@@ -140,10 +149,36 @@ class ClientHelper:
         self.checker = Checker(cryptoID, protocol, x509Fingerprint,
                                x509TrustList, x509CommonName)
         self.settings = settings
+        self.sessionCache = sessionCache
 
         self.tlsSession = None
 
+    def _sessionCacheKey(self):
+        """Identifies the server and the credentials used with it in the
+        sessionCache, so that helpers sharing a cache only resume
+        sessions authenticated as themselves.  Subclasses that know
+        which host they connect to set self.host and self.port."""
+        if self.password:
+            #Hashed, since the cache may be kept outside the process
+            credentials = "srp:%s" % hashAndBase64(
+                "%s:%s" % (self.username, self.password))
+        elif self.certChain:
+            if isinstance(self.certChain, X509CertChain):
+                credentials = "x509:%s" % self.certChain.getFingerprint()
+            else:
+                credentials = "cryptoID:%s" % self.certChain.cryptoID
+        else:
+            credentials = "anonymous"
+        return "%s:%s:%s" % (getattr(self, "host", None),
+                             getattr(self, "port", None), credentials)
+
     def _handshake(self, tlsConnection):
+        if self.sessionCache is not None and not self.sharedKey \
+                and not self.tlsSession:
+            try:
+                self.tlsSession = self.sessionCache[self._sessionCacheKey()]
+            except KeyError:
+                pass
         if self.username and self.password:
             tlsConnection.handshakeClientSRP(username=self.username,
                                              password=self.password,
@@ -161,3 +196,6 @@ class ClientHelper:
                                               settings=self.settings,
                                               session=self.tlsSession)
         self.tlsSession = tlsConnection.session
+        if self.sessionCache is not None and not self.sharedKey \
+                and self.tlsSession.resumable:
+            self.sessionCache[self._sessionCacheKey()] = self.tlsSession
@@ -62,7 +62,7 @@ class HTTPTLSConnection(HTTPBaseTLSConnection, ClientHelper):
                  cryptoID=None, protocol=None,
                  x509Fingerprint=None,
                  x509TrustList=None, x509CommonName=None,
-                 settings = None):
+                 settings = None, sessionCache=None):
         """Create a new HTTPTLSConnection.
 
         For client authentication, use one of these argument
@@ -153,6 +153,11 @@ class HTTPTLSConnection(HTTPBaseTLSConnection, ClientHelper):
         @param settings: Various settings which can be used to control
         the ciphersuites, certificate types, and SSL/TLS versions
         offered by the client.
+
+        @type sessionCache: L{tlslite.SessionCache.SessionCache}
+        @param sessionCache: A cache shared by connections to resume
+        sessions from; pass the same cache to each HTTPTLSConnection so
+        that repeated requests to a host skip the full handshake.
         """
 
         HTTPBaseTLSConnection.__init__(self, host, port)
@@ -163,7 +168,7 @@ class HTTPTLSConnection(HTTPBaseTLSConnection, ClientHelper):
                  cryptoID, protocol,
                  x509Fingerprint,
                  x509TrustList, x509CommonName,
-                 settings)
+                 settings, sessionCache)
 
     def _handshake(self, tlsConnection):
         ClientHelper._handshake(self, tlsConnection)
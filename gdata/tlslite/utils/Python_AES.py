@@ -1,14 +1,25 @@
 """Pure-Python AES implementation."""
 
+import struct
+
 from cryptomath import *
 
 from AES import *
-from rijndael import rijndael
+from rijndael import rijndael, S, Si, T1, T2, T3, T4, T5, T6, T7, T8
 
 def new(key, mode, IV):
     return Python_AES(key, mode, IV)
 
 class Python_AES(AES):
+    """CBC-mode AES on 32-bit words.
+
+    The rijndael key schedule and T-tables are used directly: each buffer
+    is unpacked into words once, every block is run through four table
+    lookups per word per round, and the result is packed back into a string
+    at the end, rather than converting every block to and from a string
+    for rijndael.encrypt and rijndael.decrypt.
+    """
+
     def __init__(self, key, mode, IV):
         AES.__init__(self, key, mode, IV, "python")
         self.rijndael = rijndael(key, 16)
@@ -16,53 +27,149 @@ class Python_AES(AES):
 
     def encrypt(self, plaintext):
         AES.encrypt(self, plaintext)
+        if not isinstance(plaintext, str):
+            plaintext = bytesToString(plaintext)
 
-        plaintextBytes = stringToBytes(plaintext)
-        chainBytes = stringToBytes(self.IV)
-
-        #CBC Mode: For each block...
-        for x in range(len(plaintextBytes)/16):
-
-            #XOR with the chaining block
-            blockBytes = plaintextBytes[x*16 : (x*16)+16]
-            for y in range(16):
-                blockBytes[y] ^= chainBytes[y]
-            blockString = bytesToString(blockBytes)
-
-            #Encrypt it
-            encryptedBytes = stringToBytes(self.rijndael.encrypt(blockString))
+        Ke = self.rijndael.Ke
+        k0, k1, k2, k3 = Ke[0]
+        roundKeys = Ke[1:-1]
+        f0, f1, f2, f3 = Ke[-1]
 
-            #Overwrite the input with the output
-            for y in range(16):
-                plaintextBytes[(x*16)+y] = encryptedBytes[y]
+        words = struct.unpack(">%dL" % (len(plaintext) / 4), plaintext)
+        c0, c1, c2, c3 = struct.unpack(">4L", self.IV)
+        output = []
+        append = output.append
 
-            #Set the next chaining block
-            chainBytes = encryptedBytes
-
-        self.IV = bytesToString(chainBytes)
-        return bytesToString(plaintextBytes)
+        #CBC Mode: For each block...
+        for x in xrange(0, len(words), 4):
+
+            #XOR with the chaining block and the first round key
+            s0 = words[x] ^ c0 ^ k0
+            s1 = words[x+1] ^ c1 ^ k1
+            s2 = words[x+2] ^ c2 ^ k2
+            s3 = words[x+3] ^ c3 ^ k3
+
+            #Full rounds
+            for r0, r1, r2, r3 in roundKeys:
+                t0 = (T1[s0 >> 24] ^ T2[(s1 >> 16) & 0xFF] ^
+                      T3[(s2 >> 8) & 0xFF] ^ T4[s3 & 0xFF] ^ r0)
+                t1 = (T1[s1 >> 24] ^ T2[(s2 >> 16) & 0xFF] ^
+                      T3[(s3 >> 8) & 0xFF] ^ T4[s0 & 0xFF] ^ r1)
+                t2 = (T1[s2 >> 24] ^ T2[(s3 >> 16) & 0xFF] ^
+                      T3[(s0 >> 8) & 0xFF] ^ T4[s1 & 0xFF] ^ r2)
+                s3 = (T1[s3 >> 24] ^ T2[(s0 >> 16) & 0xFF] ^
+                      T3[(s1 >> 8) & 0xFF] ^ T4[s2 & 0xFF] ^ r3)
+                s0, s1, s2 = t0, t1, t2
+
+            #Last round has no MixColumns
+            c0 = ((S[s0 >> 24] << 24 | S[(s1 >> 16) & 0xFF] << 16 |
+                   S[(s2 >> 8) & 0xFF] << 8 | S[s3 & 0xFF]) ^ f0)
+            c1 = ((S[s1 >> 24] << 24 | S[(s2 >> 16) & 0xFF] << 16 |
+                   S[(s3 >> 8) & 0xFF] << 8 | S[s0 & 0xFF]) ^ f1)
+            c2 = ((S[s2 >> 24] << 24 | S[(s3 >> 16) & 0xFF] << 16 |
+                   S[(s0 >> 8) & 0xFF] << 8 | S[s1 & 0xFF]) ^ f2)
+            c3 = ((S[s3 >> 24] << 24 | S[(s0 >> 16) & 0xFF] << 16 |
+                   S[(s1 >> 8) & 0xFF] << 8 | S[s2 & 0xFF]) ^ f3)
+
+            #The ciphertext is also the next chaining block
+            append(c0)
+            append(c1)
+            append(c2)
+            append(c3)
+
+        self.IV = struct.pack(">4L", c0, c1, c2, c3)
+        return struct.pack(">%dL" % len(output), *output)
 
     def decrypt(self, ciphertext):
         AES.decrypt(self, ciphertext)
+        if not isinstance(ciphertext, str):
+            ciphertext = bytesToString(ciphertext)
 
-        ciphertextBytes = stringToBytes(ciphertext)
-        chainBytes = stringToBytes(self.IV)
+        Kd = self.rijndael.Kd
+        k0, k1, k2, k3 = Kd[0]
+        roundKeys = Kd[1:-1]
+        f0, f1, f2, f3 = Kd[-1]
 
-        #CBC Mode: For each block...
-        for x in range(len(ciphertextBytes)/16):
+        words = struct.unpack(">%dL" % (len(ciphertext) / 4), ciphertext)
+        c0, c1, c2, c3 = struct.unpack(">4L", self.IV)
+        output = []
+        append = output.append
 
-            #Decrypt it
-            blockBytes = ciphertextBytes[x*16 : (x*16)+16]
-            blockString = bytesToString(blockBytes)
-            decryptedBytes = stringToBytes(self.rijndael.decrypt(blockString))
-
-            #XOR with the chaining block and overwrite the input with output
-            for y in range(16):
-                decryptedBytes[y] ^= chainBytes[y]
-                ciphertextBytes[(x*16)+y] = decryptedBytes[y]
+        #CBC Mode: For each block...
+        for x in xrange(0, len(words), 4):
+            w0 = words[x]
+            w1 = words[x+1]
+            w2 = words[x+2]
+            w3 = words[x+3]
+
+            s0 = w0 ^ k0
+            s1 = w1 ^ k1
+            s2 = w2 ^ k2
+            s3 = w3 ^ k3
+
+            #Full rounds
+            for r0, r1, r2, r3 in roundKeys:
+                t0 = (T5[s0 >> 24] ^ T6[(s3 >> 16) & 0xFF] ^
+                      T7[(s2 >> 8) & 0xFF] ^ T8[s1 & 0xFF] ^ r0)
+                t1 = (T5[s1 >> 24] ^ T6[(s0 >> 16) & 0xFF] ^
+                      T7[(s3 >> 8) & 0xFF] ^ T8[s2 & 0xFF] ^ r1)
+                t2 = (T5[s2 >> 24] ^ T6[(s1 >> 16) & 0xFF] ^
+                      T7[(s0 >> 8) & 0xFF] ^ T8[s3 & 0xFF] ^ r2)
+                s3 = (T5[s3 >> 24] ^ T6[(s2 >> 16) & 0xFF] ^
+                      T7[(s1 >> 8) & 0xFF] ^ T8[s0 & 0xFF] ^ r3)
+                s0, s1, s2 = t0, t1, t2
+
+            #Last round, then XOR with the chaining block
+            append((Si[s0 >> 24] << 24 | Si[(s3 >> 16) & 0xFF] << 16 |
+                    Si[(s2 >> 8) & 0xFF] << 8 | Si[s1 & 0xFF]) ^ f0 ^ c0)
+            append((Si[s1 >> 24] << 24 | Si[(s0 >> 16) & 0xFF] << 16 |
+                    Si[(s3 >> 8) & 0xFF] << 8 | Si[s2 & 0xFF]) ^ f1 ^ c1)
+            append((Si[s2 >> 24] << 24 | Si[(s1 >> 16) & 0xFF] << 16 |
+                    Si[(s0 >> 8) & 0xFF] << 8 | Si[s3 & 0xFF]) ^ f2 ^ c2)
+            append((Si[s3 >> 24] << 24 | Si[(s2 >> 16) & 0xFF] << 16 |
+                    Si[(s1 >> 8) & 0xFF] << 8 | Si[s0 & 0xFF]) ^ f3 ^ c3)
 
             #Set the next chaining block
-            chainBytes = blockBytes
-
-        self.IV = bytesToString(chainBytes)
-        return bytesToString(ciphertextBytes)
+            c0, c1, c2, c3 = w0, w1, w2, w3
+
+        self.IV = struct.pack(">4L", c0, c1, c2, c3)
+        return struct.pack(">%dL" % len(output), *output)
+
+
+def _blockwiseEncrypt(cipher, plaintext):
+    """CBC encryption one rijndael.encrypt call per block, for comparison."""
+    chain = cipher.IV
+    blocks = []
+    for x in range(0, len(plaintext), 16):
+        block = "".join([chr(ord(a) ^ ord(b)) for a, b in
+                         zip(plaintext[x:x+16], chain)])
+        chain = cipher.rijndael.encrypt(block)
+        blocks.append(chain)
+    cipher.IV = chain
+    return "".join(blocks)
+
+def benchmark(size=16384, repeat=5):
+    """Prints the CBC throughput of Python_AES against block-at-a-time
+    rijndael calls, and checks that the two agree."""
+    import time
+    key = "".join([chr(x) for x in range(16)])
+    IV = "".join([chr(x) for x in range(16, 32)])
+    data = "".join([chr(x % 256) for x in range(size)])
+
+    expected = _blockwiseEncrypt(Python_AES(key, 2, IV), data)
+    assert Python_AES(key, 2, IV).encrypt(data) == expected
+    assert Python_AES(key, 2, IV).decrypt(expected) == data
+
+    for name, function in (
+            ("rijndael blocks", lambda c: _blockwiseEncrypt(c, data)),
+            ("Python_AES encrypt", lambda c: c.encrypt(data)),
+            ("Python_AES decrypt", lambda c: c.decrypt(expected))):
+        cipher = Python_AES(key, 2, IV)
+        start = time.time()
+        for x in range(repeat):
+            function(cipher)
+        elapsed = time.time() - start
+        print "%-20s %8.1f KB/s" % (name, size * repeat / 1024.0 / elapsed)
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,5 +1,7 @@
 """Pure-Python RC4 implementation."""
 
+from binascii import hexlify, unhexlify
+
 from RC4 import RC4
 from cryptomath import *
 
@@ -21,19 +23,33 @@ class Python_RC4(RC4):
         self.j = 0
 
     def encrypt(self, plaintext):
-        plaintextBytes = stringToBytes(plaintext)
+        if not isinstance(plaintext, str):
+            plaintext = bytesToString(plaintext)
+        length = len(plaintext)
+        if length == 0:
+            return ""
+
+        #Generate the keystream for the whole record first
         S = self.S
         i = self.i
         j = self.j
-        for x in range(len(plaintextBytes)):
-            i = (i + 1) % 256
-            j = (j + S[i]) % 256
-            S[i], S[j] = S[j], S[i]
-            t = (S[i] + S[j]) % 256
-            plaintextBytes[x] ^= S[t]
+        keystream = [0] * length
+        for x in xrange(length):
+            i = (i + 1) & 0xFF
+            a = S[i]
+            j = (j + a) & 0xFF
+            b = S[j]
+            S[i] = b
+            S[j] = a
+            keystream[x] = S[(a + b) & 0xFF]
         self.i = i
         self.j = j
-        return bytesToString(plaintextBytes)
+
+        #Then XOR it in all at once, as one big number
+        keystream = bytesToString(createByteArraySequence(keystream))
+        result = "%x" % (long(hexlify(plaintext), 16) ^
+                         long(hexlify(keystream), 16))
+        return unhexlify(result.zfill(length * 2))
 
     def decrypt(self, ciphertext):
         return self.encrypt(ciphertext)
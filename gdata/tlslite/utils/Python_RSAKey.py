@@ -17,8 +17,9 @@ class Python_RSAKey(RSAKey):
         self.dP = dP
         self.dQ = dQ
         self.qInv = qInv
-        self.blinder = 0
-        self.unblinder = 0
+        #(blinder, unblinder), replaced as a unit so that threads sharing
+        #the key never combine halves of different pairs
+        self.blinding = None
 
     def hasPrivateKey(self):
         return self.d != 0
@@ -29,31 +30,41 @@ class Python_RSAKey(RSAKey):
 
     def _rawPrivateKeyOp(self, m):
         #Create blinding values, on the first pass:
-        if not self.blinder:
-            self.unblinder = getRandomNumber(2, self.n)
-            self.blinder = powMod(invMod(self.unblinder, self.n), self.e,
-                                  self.n)
+        blinding = self.blinding
+        if blinding is None:
+            unblinder = getRandomNumber(2, self.n)
+            blinder = powMod(invMod(unblinder, self.n), self.e, self.n)
+        else:
+            blinder, unblinder = blinding
+
+        #Update blinding values for the next operation, which squaring
+        #makes much cheaper than creating new ones
+        self.blinding = ((blinder * blinder) % self.n,
+                         (unblinder * unblinder) % self.n)
 
         #Blind the input
-        m = (m * self.blinder) % self.n
+        m = (m * blinder) % self.n
 
         #Perform the RSA operation
         c = self._rawPrivateKeyOpHelper(m)
 
         #Unblind the output
-        c = (c * self.unblinder) % self.n
-
-        #Update blinding values
-        self.blinder = (self.blinder * self.blinder) % self.n
-        self.unblinder = (self.unblinder * self.unblinder) % self.n
+        c = (c * unblinder) % self.n
 
         #Return the output
         return c
 
 
     def _rawPrivateKeyOpHelper(self, m):
-        #Non-CRT version
-        #c = powMod(m, self.d, self.n)
+        #Non-CRT version, for keys without the factors of n
+        if not (self.p and self.q):
+            return powMod(m, self.d, self.n)
+
+        #Work out any missing CRT parameters once
+        if not (self.dP and self.dQ and self.qInv):
+            self.dP = self.d % (self.p-1)
+            self.dQ = self.d % (self.q-1)
+            self.qInv = invMod(self.q, self.p)
 
         #CRT version  (~3x faster)
         s1 = powMod(m, self.dP, self.p)
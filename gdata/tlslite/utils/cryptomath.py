@@ -113,22 +113,20 @@ except:
 # Converter Functions
 # **************************************************************************
 
+#Both conversions go through a hex string, which the interpreter converts
+#to and from a long in linear time, rather than doing one long
+#multiplication or division per byte
 def bytesToNumber(bytes):
-    total = 0L
-    multiplier = 1L
-    for count in range(len(bytes)-1, -1, -1):
-        byte = bytes[count]
-        total += multiplier * byte
-        multiplier *= 256
-    return total
+    if len(bytes) == 0:
+        return 0L
+    return long(binascii.hexlify(bytesToString(bytes)), 16)
 
 def numberToBytes(n):
     howManyBytes = numBytes(n)
-    bytes = createByteArrayZeros(howManyBytes)
-    for count in range(howManyBytes-1, -1, -1):
-        bytes[count] = int(n % 256)
-        n >>= 8
-    return bytes
+    if howManyBytes == 0:
+        return createByteArrayZeros(0)
+    s = "%x" % n
+    return stringToBytes(binascii.unhexlify(s.zfill(howManyBytes * 2)))
 
 def bytesToBase64(bytes):
     s = bytesToString(bytes)
@@ -6,11 +6,14 @@ from google.appengine.api import memcache
 
 class FamilyListHandler(handler.RequestHandler):
   def get(self):
+    if self.not_modified():
+      return
     families = model.TagFamily.all()
     metadata = model.PuzzleMetadata.all()
     self.render_template("families", {
       "families": families,
       "metadata": metadata,
+      "metadata_types": model.PuzzleMetadata.TYPES,
     })
 
 
@@ -70,8 +73,12 @@ class FamilyDeleteHandler(handler.RequestHandler):
 class AdminMetadataCreateHandler(handler.RequestHandler):
   def post(self):
     name = model.CanonicalizeTagPiece(self.request.get('name'))
+    value_type = self.request.get('value_type', 'string')
+    if value_type not in model.PuzzleMetadata.TYPES:
+      self.bad_request('Unknown metadata type: %s' % value_type)
+      return
     # TODO(glasser): Better error handling.
-    model.PuzzleMetadata.get_or_insert(name)
+    model.PuzzleMetadata.get_or_insert(name, value_type=value_type)
     self.redirect(FamilyListHandler.get_url())
 
 
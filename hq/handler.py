@@ -1,8 +1,13 @@
 #!/usr/bin/env python2.5
 
 import base64
+import cgi
+import email.Utils
+import gzip
+import hashlib
 import logging
 import os
+import time
 
 from google.appengine.api import memcache
 from google.appengine.ext import webapp
@@ -12,12 +17,28 @@ from hq import model
 
 INSTANCE_NAME = 'Battlestar Electronica'
 
+# Whether render_template should gzip pages itself for clients that
+# accept it.  The production App Engine frontend strips Content-Encoding
+# from responses (and compresses on its own), so only turn this on when
+# serving from somewhere that passes the header through.
+GZIP_RESPONSES = False
+# Pages smaller than this aren't worth the CPU.
+GZIP_MIN_SIZE = 1024
+
 port = os.environ['SERVER_PORT']
 if port and port != '80':
   HOST_NAME = '%s:%s' % (os.environ['SERVER_NAME'], port)
 else:
   HOST_NAME = os.environ['SERVER_NAME']
 
+
+def GzipETag(etag):
+  """Returns the ETag for the gzipped encoding of the page with ETAG.
+  The two encodings aren't the same bytes, so they can't share a strong
+  ETag."""
+  return etag[:-1] + '-gzip"'
+
+
 # Inspired by mox's MoxMetaTestBase.
 class RequestHandlerMetaClass(type):
   """Metaclass to do auth checks at the beginning of get and post methods."""
@@ -62,9 +83,12 @@ class RequestHandler(webapp.RequestHandler):
 
     # Deal with username cookie.
     self.username = self.request.cookies.get(self.COOKIE_NAME, self.NOBODY)
+    # Set by not_modified.
+    self.generation = None
 
   def set_username(self, username):
     self.username = username
+    model.BumpGeneration()
     self.response.headers.add_header(
         'Set-Cookie',
         '%s=%s; path=/; expires=Fri, 31-Dec-2020 23:59:59 GMT' \
@@ -94,13 +118,106 @@ class RequestHandler(webapp.RequestHandler):
       self.response.headers['WWW-Authenticate'] = 'Basic realm="CIC"'
       return False
 
+  def not_modified(self):
+    """Sets ETag and Last-Modified headers based on the datastore
+    generation, and returns True (having set up a 304 response) if the
+    client's cached copy is still current.  Read handlers should call
+    this before doing anything else, and return immediately if it
+    returns True."""
+    (generation, modified) = model.CurrentGeneration()
+    # Kept so the rest of the request can key caches on it.
+    self.generation = generation
+    # Pages include the current username, so it needs to be in the ETag.
+    etag = '"%s-%s"' % (generation, hashlib.md5(
+        self.username.encode('utf-8')).hexdigest())
+    self.response.headers['ETag'] = etag
+    # Last-Modified only has whole seconds, so until the second of the
+    # last write is over another write could land in it without changing
+    # the header, and a client revalidating with If-Modified-Since would
+    # keep its stale copy.  Leave the header off until then; the ETag
+    # covers those requests.
+    if time.time() >= int(modified) + 1:
+      self.response.headers['Last-Modified'] = email.Utils.formatdate(
+          int(modified), usegmt=True)
+    modified = int(modified)
+
+    if_none_match = self.request.headers.get('If-None-Match')
+    if if_none_match is not None:
+      # If-None-Match takes precedence over If-Modified-Since.
+      tags = [t.strip() for t in if_none_match.split(',')]
+      matched = (if_none_match.strip() == '*' or etag in tags)
+      if not matched and GzipETag(etag) in tags:
+        # A cached gzipped copy is just as current.
+        self.response.headers['ETag'] = GzipETag(etag)
+        matched = True
+    else:
+      # Last-Modified doesn't cover the username, which is why
+      # set_username bumps the generation.
+      matched = False
+      if_modified_since = self.request.headers.get('If-Modified-Since')
+      if if_modified_since:
+        parsed = email.Utils.parsedate_tz(if_modified_since)
+        if parsed is not None:
+          matched = modified <= email.Utils.mktime_tz(parsed)
+
+    if matched:
+      self.response.set_status(304)
+      self.response.clear()
+    return matched
+
+  def bad_request(self, message):
+    """Responds with a 400 and MESSAGE (plain text, escaped here), for
+    form input that can't be used."""
+    self.error(400)
+    self.response.out.write(cgi.escape(message))
+
   def render_template(self, template_name, params, **kwds):
     params['usernames'] = model.Username.all()
     params['current_user'] = self.username
     (params['unsolved_puzzle_count'],
      params['unsolved_puzzle_thirds']) = model.Puzzle.unsolved_count()
-    self.response.out.write(self.render_template_to_string(template_name,
-                                                           params, **kwds))
+    self.write_body(self.render_template_to_string(template_name,
+                                                   params, **kwds))
+
+  def accepts_gzip(self):
+    for coding in self.request.headers.get('Accept-Encoding', '').split(','):
+      pieces = [p.strip() for p in coding.split(';')]
+      if pieces[0].lower() not in ('gzip', 'x-gzip', '*'):
+        continue
+      for param in pieces[1:]:
+        if param.startswith('q='):
+          try:
+            if float(param[2:]) == 0:
+              return False
+          except ValueError:
+            return False
+      return True
+    return False
+
+  def write_body(self, body):
+    """Writes BODY to the response, gzipped if GZIP_RESPONSES is set and
+    the client accepts it."""
+    if isinstance(body, unicode):
+      body = body.encode('utf-8')
+    if not GZIP_RESPONSES:
+      self.response.out.write(body)
+      return
+    self.response.headers.add_header('Vary', 'Accept-Encoding')
+    if len(body) < GZIP_MIN_SIZE or not self.accepts_gzip():
+      self.response.out.write(body)
+      return
+    self.response.headers['Content-Encoding'] = 'gzip'
+    etag = self.response.headers.get('ETag')
+    if etag:
+      self.response.headers['ETag'] = GzipETag(etag)
+    # Compress straight into the response rather than into another
+    # intermediate string.
+    zipper = gzip.GzipFile(mode='wb', fileobj=self.response.out,
+                           compresslevel=6)
+    try:
+      zipper.write(body)
+    finally:
+      zipper.close()
 
   @classmethod
   def render_template_to_string(cls, template_name, params,
@@ -133,12 +250,17 @@ class RequestHandler(webapp.RequestHandler):
 
   @classmethod
   def render_newsfeeds(cls):
-    rendered = memcache.get(model.Newsfeed.MEMCACHE_KEY)
-    if rendered is not None:
-      return rendered
-    newsfeeds = model.Newsfeed.all().order('-created')
+    # The rendering is only reused if the ring buffer hasn't moved on.
+    cached = memcache.get_multi([model.Newsfeed.MEMCACHE_KEY,
+                                 model.Newsfeed.RING_HEAD_KEY])
+    head = cached.get(model.Newsfeed.RING_HEAD_KEY)
+    rendered = cached.get(model.Newsfeed.MEMCACHE_KEY)
+    if head is not None and rendered is not None and rendered[0] == head:
+      return rendered[1]
+    (head, newsfeeds) = model.Newsfeed.recent()
     rendered = cls.render_template_to_string('newsfeeds', {
-      'newsfeeds': newsfeeds.fetch(15),
+      'newsfeeds': newsfeeds,
     }, include_rendered_banners=False, include_rendered_newsfeeds=False)
-    memcache.set(model.Newsfeed.MEMCACHE_KEY, rendered)
+    if head is not None:
+      memcache.set(model.Newsfeed.MEMCACHE_KEY, (head, rendered))
     return rendered
@@ -2,7 +2,9 @@
 
 import datetime
 import re
+import time
 
+from google.appengine.api import apiproxy_stub_map
 from google.appengine.api import datastore
 from google.appengine.api import memcache
 from google.appengine.ext import db
@@ -114,10 +116,83 @@ class PuzzleMetadata(db.Model):
       ValidateMetadataName(kwds['key_name'])
     super(PuzzleMetadata, self).__init__(*args, **kwds)
 
+  # Values are stored on the puzzle with a real type, so that sorting by
+  # a number field is numeric rather than lexical.
+  TYPES = ('string', 'number', 'timestamp')
+  TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+  value_type = db.StringProperty(choices=TYPES, default='string')
+
+  MEMCACHE_KEY = 'metadata:schema'
+
+  # Warning: using db.put or db.delete won't trigger these memcache deletes!
+  def delete(self):
+    super(PuzzleMetadata, self).delete()
+    memcache.delete(self.MEMCACHE_KEY)
+  def put(self):
+    key = super(PuzzleMetadata, self).put()
+    memcache.delete(self.MEMCACHE_KEY)
+    return key
+
+  @classmethod
+  def schema(cls):
+    """Returns a list of (name, value_type) pairs for every metadata
+    field, ordered by name."""
+    schema = memcache.get(cls.MEMCACHE_KEY)
+    if schema is not None:
+      return schema
+    schema = [(m.key().name(), m.value_type) for m in cls.all()]
+    memcache.set(cls.MEMCACHE_KEY, schema)
+    return schema
+
+  @classmethod
+  def value_type_for(cls, name):
+    for (field, value_type) in cls.schema():
+      if field == name:
+        return value_type
+    return 'string'
+
   @staticmethod
   def puzzle_field_name(name):
     return 'metadata_%s' % name.replace('-', '_')
 
+  @classmethod
+  def parse_value(cls, value_type, text):
+    """Converts TEXT (as typed into a form) to the value stored on the
+    puzzle; empty text is stored as None for non-string fields.  Raises
+    db.BadValueError if TEXT doesn't parse."""
+    if value_type == 'string':
+      return text
+    text = text.strip()
+    if not text:
+      return None
+    if value_type == 'number':
+      try:
+        return int(text)
+      except ValueError:
+        try:
+          return float(text)
+        except ValueError:
+          raise db.BadValueError("'%s' is not a number" % text)
+    if value_type == 'timestamp':
+      for format in cls.TIMESTAMP_FORMATS:
+        try:
+          return datetime.datetime.strptime(text, format)
+        except ValueError:
+          pass
+      raise db.BadValueError("'%s' is not a timestamp" % text)
+    assert False, "unknown metadata type '%s'" % value_type
+
+  @classmethod
+  def format_value(cls, value):
+    """The inverse of parse_value: the text to show for a stored value."""
+    if value is None:
+      return ''
+    if isinstance(value, datetime.datetime):
+      if value.second:
+        return value.strftime(cls.TIMESTAMP_FORMATS[0])
+      return value.strftime(cls.TIMESTAMP_FORMATS[1])
+    return unicode(value)
+
 
 class Puzzle(db.Expando):
   # TODO(glasser): Maximum length is 500 for StringProperty (unindexed
@@ -127,6 +202,21 @@ class Puzzle(db.Expando):
   # TODO(glasser): Validate that no family has multiple tags.
   tags = ValidatingStringListProperty(validator=ValidateUniqueTagNames)
 
+  def __init__(self, *args, **kwds):
+    super(Puzzle, self).__init__(*args, **kwds)
+    self.__families = None
+    self.__formatted_metadata = None
+
+  def use_families(self, families):
+    """Makes families and ordered_families use FAMILIES (a list of all
+    TagFamily entities) rather than querying for them on each call."""
+    self.__families = families
+
+  def __all_families(self):
+    if self.__families is None:
+      return TagFamily.all()
+    return self.__families
+
   @classmethod
   def add_tag(cls, id, tag):
     """Adds a tag to the puzzle; returns True if this was a change
@@ -182,8 +272,7 @@ class Puzzle(db.Expando):
 
   def families(self):
     ret = {}
-    families = TagFamily.all()
-    for family in families:
+    for family in self.__all_families():
       puzzle_options = []
       found_any = False
       for option in family.options:
@@ -198,7 +287,7 @@ class Puzzle(db.Expando):
 
   def ordered_families(self):
     ret = []
-    for family in TagFamily.all():
+    for family in self.__all_families():
       for option in family.options:
         tag_name = '%s:%s' % (family.key().name(), option)
         if tag_name in self.tags:
@@ -217,15 +306,28 @@ class Puzzle(db.Expando):
 
   def metadata(self):
     metadata = []
-    for metadatum in PuzzleMetadata.all():
-      field_name = PuzzleMetadata.puzzle_field_name(metadatum.key().name())
-      try:
-        value = getattr(self, field_name)
-      except AttributeError, e:
-        value = None
-      metadata.append((metadatum.key().name(), value))
+    for (name, value_type) in PuzzleMetadata.schema():
+      field_name = PuzzleMetadata.puzzle_field_name(name)
+      value = getattr(self, field_name, None)
+      metadata.append((name, PuzzleMetadata.format_value(value)))
     return metadata
 
+  def formatted_metadata(self, schema=None):
+    """Maps each metadata field name to its value as text, formatted as
+    in metadata.  List templates index it with show_meta_fields, so it is
+    built once and kept; PuzzleQuery passes SCHEMA so that a whole list
+    reads the schema only once."""
+    if self.__formatted_metadata is None:
+      if schema is None:
+        schema = PuzzleMetadata.schema()
+      formatted = {}
+      for (name, value_type) in schema:
+        field_name = PuzzleMetadata.puzzle_field_name(name)
+        formatted[field_name] = PuzzleMetadata.format_value(
+            getattr(self, field_name, None))
+      self.__formatted_metadata = formatted
+    return self.__formatted_metadata
+
   def tags_as_css_classes(self):
     def as_css_class(tag):
       return 'tag_' + tag.replace(':', '_')
@@ -269,6 +371,8 @@ class PuzzleQuery(object):
     # Just a list of metadata names that should be shown in any
     # displayed list.  (You may access this directly.)
     self.show_metas = show_metas
+    # The filtered, sorted list of puzzles, once we've run the query.
+    self.__results = None
 
   @classmethod
   def parse(cls, path):
@@ -319,9 +423,52 @@ class PuzzleQuery(object):
         negative_tags.add('deleted')
     return cls(db_query, orders, tags, negative_tags, show_metas)
 
+  @classmethod
+  def prefetch(cls, queries, families=None):
+    """Runs all of QUERIES up front, so that iterating over them later
+    doesn't touch the datastore.  When there is more than one query, all
+    puzzles are fetched once and each query is filtered in memory, which
+    is one datastore round trip instead of one per query.  If FAMILIES is
+    given, the puzzles share it for their families methods."""
+    if len(queries) == 1:
+      queries[0].results(families=families)
+    elif queries:
+      all_puzzles = list(Puzzle.all())
+      if families is not None:
+        for puzzle in all_puzzles:
+          puzzle.use_families(families)
+      for query in queries:
+        query.__results = query.__filter_and_sort(
+            [p for p in all_puzzles if query.__tags.issubset(p.tags)])
+    cls.__format_metadata(queries)
+
+  @classmethod
+  def __format_metadata(cls, queries):
+    schema = None
+    for query in queries:
+      if not query.show_metas:
+        continue
+      if schema is None:
+        schema = PuzzleMetadata.schema()
+      for puzzle in query.__results:
+        puzzle.formatted_metadata(schema)
+
+  def results(self, families=None):
+    """Returns the (cached) list of matching puzzles."""
+    if self.__results is None:
+      puzzles = list(self.__db_query)
+      if families is not None:
+        for puzzle in puzzles:
+          puzzle.use_families(families)
+      self.__results = self.__filter_and_sort(puzzles)
+    return self.__results
+
   def __iter__(self):
+    return iter(self.results())
+
+  def __filter_and_sort(self, candidates):
     puzzles = []
-    for puzzle in self.__db_query:
+    for puzzle in candidates:
       valid = True
       for tag in puzzle.tags:
         if tag in self.__negative_tags:
@@ -332,16 +479,10 @@ class PuzzleQuery(object):
 
     def compare_by_orders(a, b):
       # Based loosely on order_compare_entities in datastore_file_stub.
+      # Metadata values are stored typed (see PuzzleMetadata.parse_value),
+      # so this compares numbers and timestamps as such.
       for o in self.__orders:
-        try:
-          a_val = getattr(a, o[0])
-        except AttributeError:
-          a_val = None
-        try:
-          b_val = getattr(b, o[0])
-        except AttributeError:
-          b_val = None
-        cmped = cmp(a_val, b_val)
+        cmped = cmp(getattr(a, o[0], None), getattr(b, o[0], None))
         if o[1] == datastore.Query.DESCENDING:
           cmped = -cmped
         if cmped != 0:
@@ -349,7 +490,7 @@ class PuzzleQuery(object):
       return cmp(a.key(), b.key())
 
     puzzles.sort(compare_by_orders)
-    return iter(puzzles)
+    return puzzles
 
   def describe_query(self):
     return " ".join(["[%s]" % tag for tag in self.__tags]
@@ -475,15 +616,87 @@ class Newsfeed(db.Model):
   contents = db.TextProperty()
   created  = db.DateTimeProperty(auto_now_add=True)
 
+  # The rendered list is stored here as (ring head, rendered html).
   MEMCACHE_KEY = 'rendered:newsfeeds'
 
-  # Warning: using db.put or db.delete won't trigger these memcache flushes!
+  # The most recent newsfeeds are kept in memcache as a ring buffer of
+  # RING_SIZE slots, so showing them doesn't need a query.  The head is a
+  # sequence number bumped with memcache.incr for each append (so appends
+  # don't race), and the entry with sequence number N lives in slot
+  # N % RING_SIZE, stored as (N, entry) so readers can tell an up-to-date
+  # slot from one that is about to be overwritten.  The datastore is still
+  # the real copy: whenever the buffer looks wrong, it's rebuilt from a
+  # query.
+  RING_SIZE = 15
+  RING_HEAD_KEY = 'newsfeeds:head'
+  RING_SLOT_KEY = 'newsfeeds:slot:%d'
+
+  # Warning: using db.put or db.delete won't update the ring buffer!
   def delete(self):
-    super(Banner, self).delete()
-    memcache.flush_all()
+    super(Newsfeed, self).delete()
+    # Simplest to make the next reader rebuild from the datastore.
+    memcache.delete(self.RING_HEAD_KEY)
   def put(self):
-    super(Newsfeed, self).put()
-    memcache.flush_all()
+    key = super(Newsfeed, self).put()
+    head = memcache.incr(self.RING_HEAD_KEY)
+    # If there's no head, the next reader rebuilds the buffer from the
+    # datastore, which already has us.
+    if head is not None:
+      memcache.set(self.RING_SLOT_KEY % (head % self.RING_SIZE),
+                   (head, self.as_ring_entry()))
+    return key
+
+  def as_ring_entry(self):
+    return {
+      'created_display': self.created_display(),
+      'contents': self.contents,
+    }
+
+  @classmethod
+  def recent(cls):
+    """Returns a pair (head, entries), where entries is a list of dicts
+    with 'created_display' and 'contents' keys for the latest RING_SIZE
+    newsfeeds, newest first.  head identifies this state of the buffer; it
+    is None if the buffer couldn't be stored."""
+    head = memcache.get(cls.RING_HEAD_KEY)
+    if head is not None:
+      sequence = range(head, head - cls.RING_SIZE, -1)
+      slots = memcache.get_multi([cls.RING_SLOT_KEY % (n % cls.RING_SIZE)
+                                  for n in sequence])
+      entries = []
+      for n in sequence:
+        slot = slots.get(cls.RING_SLOT_KEY % (n % cls.RING_SIZE))
+        if slot is None or slot[0] != n:
+          # Evicted, or an append hasn't written its slot yet.
+          break
+        if slot[1] is None:
+          # There are fewer than RING_SIZE newsfeeds in total.
+          return (head, entries)
+        entries.append(slot[1])
+      else:
+        return (head, entries)
+      memcache.delete(cls.RING_HEAD_KEY)
+    return cls.__rebuild_ring()
+
+  @classmethod
+  def __rebuild_ring(cls):
+    entries = [n.as_ring_entry()
+               for n in cls.all().order('-created').fetch(cls.RING_SIZE)]
+    # Start from the clock, so that a rebuilt ring never reuses a head
+    # that some cached rendering was made at.
+    head = long(time.time() * 1000)
+    slots = {}
+    for (index, n) in enumerate(range(head, head - cls.RING_SIZE, -1)):
+      entry = None
+      if index < len(entries):
+        entry = entries[index]
+      slots[cls.RING_SLOT_KEY % (n % cls.RING_SIZE)] = (n, entry)
+    memcache.set_multi(slots)
+    # If somebody else got there first, their buffer might be newer than
+    # our query; don't overwrite it.
+    if not memcache.add(cls.RING_HEAD_KEY, head):
+      head = None
+    return (head, entries)
 
   def created_display(self):
     """The date as a displayable string; doesn't need to be escaped.  This
@@ -538,3 +751,55 @@ class HeaderLink(db.Model):
   title = db.StringProperty(required=True)
   href = db.StringProperty(required=True)
   created  = db.DateTimeProperty(auto_now_add=True)
+
+
+# The generation is a number that changes whenever anything in the
+# datastore changes, so that read handlers can answer conditional GETs
+# without touching the datastore or the templates.  It lives only in
+# memcache; when it gets evicted (or flushed, which we do a lot) it is
+# reseeded from the clock, so a new generation never matches an ETag
+# handed out before the flush.
+GENERATION_MEMCACHE_KEY = 'generation'
+GENERATION_MODIFIED_MEMCACHE_KEY = 'generation:modified'
+
+def _SeedGeneration():
+  now = time.time()
+  memcache.add(GENERATION_MODIFIED_MEMCACHE_KEY, now)
+  if memcache.add(GENERATION_MEMCACHE_KEY, long(now * 1000)):
+    return long(now * 1000)
+  # Somebody else seeded it first.
+  return memcache.get(GENERATION_MEMCACHE_KEY)
+
+
+def CurrentGeneration():
+  """Returns a pair (generation, last_modified), where last_modified is
+  seconds since the epoch; if memcache has lost track, both are reset to
+  now."""
+  values = memcache.get_multi([GENERATION_MEMCACHE_KEY,
+                               GENERATION_MODIFIED_MEMCACHE_KEY])
+  generation = values.get(GENERATION_MEMCACHE_KEY)
+  modified = values.get(GENERATION_MODIFIED_MEMCACHE_KEY)
+  if generation is None or modified is None:
+    generation = _SeedGeneration()
+    modified = memcache.get(GENERATION_MODIFIED_MEMCACHE_KEY) or time.time()
+  return (generation, modified)
+
+
+def BumpGeneration():
+  memcache.set(GENERATION_MODIFIED_MEMCACHE_KEY, time.time())
+  if memcache.incr(GENERATION_MEMCACHE_KEY) is None:
+    _SeedGeneration()
+
+
+def _BumpGenerationHook(service, call, request, response):
+  # Catching the datastore calls themselves means that we don't have to
+  # remember to bump the generation in every put and delete (or in db.put
+  # and db.delete, which skip the model methods).  Inside a transaction
+  # the Put or Delete comes before the Commit, so a page rendered in
+  # between would carry the new generation but the old data; bumping again
+  # on Commit makes sure that page doesn't stay current.
+  if call in ('Put', 'Delete', 'Commit'):
+    BumpGeneration()
+
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+    'hq_generation', _BumpGenerationHook, 'datastore_v3')
@@ -35,8 +35,13 @@ GDATA_SETTINGS = {
 }
 
 
-def LoadAccessToken():
-  access_token = gdata.gauth.AeLoad(GDATA_SETTINGS['ACCESS_TOKEN'])
+def LoadAccessToken(generation=None):
+  """Returns the saved OAuth access token, or None.  The token is cached in
+  the process; pass the request's datastore generation if there is one,
+  since saving the token bumps it, and the cached copy is then used without
+  asking memcache for the token's own version."""
+  access_token = gdata.gauth.AeLoad(GDATA_SETTINGS['ACCESS_TOKEN'],
+                                    version=generation, cache=True)
   if isinstance(access_token, gdata.gauth.OAuthHmacToken):
     return access_token
   return None
@@ -44,9 +49,12 @@ def LoadAccessToken():
 
 class PuzzleListHandler(handler.RequestHandler):
   def get(self, tags=None):
+    if self.not_modified():
+      return
     puzzles = model.PuzzleQuery.parse(tags)
     # Convert to list so we can iterate multiple times.
     families = list(model.TagFamily.all())
+    model.PuzzleQuery.prefetch([puzzles], families=families)
     self.render_template("puzzle-list", {
       "puzzles": puzzles,
       "families": families,
@@ -55,6 +63,8 @@ class PuzzleListHandler(handler.RequestHandler):
 
 class PuzzleHandler(handler.RequestHandler):
   def get(self, key_id):
+    if self.not_modified():
+      return
     puzzle = model.Puzzle.get_by_id(long(key_id))
     # TODO(glasser): Better error handling.
     assert puzzle is not None
@@ -65,11 +75,20 @@ class PuzzleHandler(handler.RequestHandler):
     comments.order('-created')
     # Convert to list so we can iterate multiple times.
     families = list(model.TagFamily.all())
+    puzzle.use_families(families)
+    # Run everything the template needs now, rather than having each
+    # back-reference and related puzzle list queried as it renders.
+    related_lists = list(puzzle.related_set)
+    model.PuzzleQuery.prefetch([r.puzzle_query() for r in related_lists],
+                               families=families)
     self.render_template("puzzle", {
       "puzzle": puzzle,
-      "comments": comments,
+      "comments": list(comments),
+      "spreadsheets": list(puzzle.spreadsheet_set),
+      "related_lists": related_lists,
+      "images": list(puzzle.image_set),
       "families": families,
-      "has_access_token": LoadAccessToken() is not None,
+      "has_access_token": LoadAccessToken(self.generation) is not None,
     })
 
 
@@ -93,12 +112,16 @@ class PuzzleCreateHandler(handler.RequestHandler):
         tag_set.add('%s:%s' % (family.key().name(), family_value))
     # TODO(glasser): Better error handling.
     puzzle.tags = list(tag_set)
-    for metadatum in model.PuzzleMetadata.all():
-      field_name = model.PuzzleMetadata.puzzle_field_name(
-          metadatum.key().name())
+    for (name, value_type) in model.PuzzleMetadata.schema():
+      field_name = model.PuzzleMetadata.puzzle_field_name(name)
       field_value = self.request.get(field_name)
       if field_value:
-        setattr(puzzle, field_name, field_value)
+        try:
+          typed_value = model.PuzzleMetadata.parse_value(value_type,
+                                                         field_value)
+        except db.BadValueError, e:
+          return self.bad_request('Bad value for %s: %s' % (name, e))
+        setattr(puzzle, field_name, typed_value)
     puzzle_key = puzzle.put()
 
     # we've just created a puzzle, add that to the newsfeeds
@@ -160,16 +183,19 @@ class PuzzleMetadataSetHandler(handler.RequestHandler):
     field_name = model.PuzzleMetadata.puzzle_field_name(metadata_name)
     value = self.request.get('value', '')
     base_value = self.request.get('base_value', '')
+    try:
+      typed_value = model.PuzzleMetadata.parse_value(
+          model.PuzzleMetadata.value_type_for(metadata_name), value)
+    except db.BadValueError, e:
+      return self.bad_request('Bad value for %s: %s' % (metadata_name, e))
     def txn():
       puzzle = model.Puzzle.get_by_id(puzzle_id)
-      newest_value = ''
-      try:
-        newest_value = getattr(puzzle, field_name)
-      except AttributeError:
-        pass
+      # Compare as text, since that's what the form had.
+      newest_value = model.PuzzleMetadata.format_value(
+          getattr(puzzle, field_name, None))
       if base_value != newest_value:
         raise MetadataConflictError(newest_value)
-      setattr(puzzle, field_name, value)
+      setattr(puzzle, field_name, typed_value)
       puzzle.put()
     try:
       db.run_in_transaction(txn)
@@ -1,7 +1,9 @@
 #!/usr/bin/env python2.5
+import datetime
 import random
 import unittest
 
+from google.appengine.api import memcache
 from google.appengine.ext import db
 
 import model
@@ -19,6 +21,39 @@ class TagTest(unittest.TestCase):
       self.assertRaises(db.BadValueError, model.ValidateTagPiece, x)
 
 
+class PuzzleMetadataTest(unittest.TestCase):
+
+  def test_parse_and_format_round_trip(self):
+    for (value_type, text, value) in (
+        ('string', 'foo bar', 'foo bar'),
+        ('number', '42', 42),
+        ('number', '2.5', 2.5),
+        ('timestamp', '2009-01-16 13:05',
+         datetime.datetime(2009, 1, 16, 13, 5))):
+      self.assertEquals(value,
+                        model.PuzzleMetadata.parse_value(value_type, text))
+      self.assertEquals(text, model.PuzzleMetadata.format_value(value))
+
+  def test_numbers_sort_numerically(self):
+    self.assertTrue(model.PuzzleMetadata.parse_value('number', '9') <
+                    model.PuzzleMetadata.parse_value('number', '10'))
+
+  def test_bad_values(self):
+    self.assertRaises(db.BadValueError, model.PuzzleMetadata.parse_value,
+                      'number', 'seven')
+    self.assertRaises(db.BadValueError, model.PuzzleMetadata.parse_value,
+                      'timestamp', 'friday')
+
+  def test_formatted_metadata_matches_metadata(self):
+    model.PuzzleMetadata(key_name='deadline', value_type='timestamp').put()
+    puzzle = model.Puzzle(title='Some puzzle')
+    puzzle.metadata_deadline = datetime.datetime(2009, 1, 16, 13, 5)
+    self.assertEquals('2009-01-16 13:05',
+                      puzzle.formatted_metadata()['metadata_deadline'])
+    self.assertEquals(dict(puzzle.metadata())['deadline'],
+                      puzzle.formatted_metadata()['metadata_deadline'])
+
+
 class PuzzleTest(unittest.TestCase):
 
   def test_tag_race_condition(self):
@@ -69,3 +104,42 @@ class PuzzleTest(unittest.TestCase):
     puzzle = model.Puzzle.get_by_id(puzzle_id)
     self.assertEquals(set([u'%s%d' % (prefix, runs) for prefix in prefixes]),
                       set(puzzle.tags))
+
+
+class GenerationTest(unittest.TestCase):
+
+  def test_put_and_delete_bump_generation(self):
+    first, _ = model.CurrentGeneration()
+    puzzle = model.Puzzle(title='Some puzzle')
+    puzzle.put()
+    second, _ = model.CurrentGeneration()
+    self.assertNotEquals(first, second)
+    db.delete(puzzle)
+    third, _ = model.CurrentGeneration()
+    self.assertNotEquals(second, third)
+
+  def test_transaction_commit_bumps_generation(self):
+    generations = []
+    def txn():
+      model.Puzzle(title='Some puzzle').put()
+      generations.append(model.CurrentGeneration()[0])
+    db.run_in_transaction(txn)
+    # A page rendered before the commit had the generation from inside the
+    # transaction; it must not match after the commit.
+    self.assertNotEquals(generations[-1], model.CurrentGeneration()[0])
+
+
+class NewsfeedTest(unittest.TestCase):
+
+  def test_recent_keeps_latest_entries_newest_first(self):
+    memcache.flush_all()
+    model.Newsfeed(contents='first').put()
+    # Rebuilds the ring buffer from the datastore.
+    model.Newsfeed.recent()
+    contents = ['news %d' % i for i in xrange(20)]
+    for text in contents:
+      model.Newsfeed(contents=text).put()
+    head, entries = model.Newsfeed.recent()
+    self.assertNotEquals(None, head)
+    self.assertEquals(list(reversed(contents))[:model.Newsfeed.RING_SIZE],
+                      [entry['contents'] for entry in entries])
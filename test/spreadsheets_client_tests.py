@@ -0,0 +1,96 @@
+#!/usr/bin/env python2.5
+import StringIO
+import unittest
+
+import atom.core
+import atom.http_core
+import gdata.spreadsheets.client
+import gdata.spreadsheets.data
+
+CELLS = 'https://spreadsheets.google.com/feeds/cells/key/od6/private/full'
+
+FEED = ('<feed xmlns="http://www.w3.org/2005/Atom"'
+        ' xmlns:gd="http://schemas.google.com/g/2005"'
+        ' xmlns:batch="http://schemas.google.com/gdata/batch"'
+        ' xmlns:gs="http://schemas.google.com/spreadsheets/2006">'
+        '%s</feed>')
+
+ENTRY = ('<entry gd:etag=\'"%(etag)s"\'>%(batch)s'
+         '<id>' + CELLS + '/R%(row)dC%(col)d</id>'
+         '<link rel="edit" type="application/atom+xml"'
+         ' href="' + CELLS + '/R%(row)dC%(col)d/1"/>'
+         '<gs:cell row="%(row)d" col="%(col)d"'
+         ' inputValue="%(value)s">%(value)s</gs:cell></entry>')
+
+
+def CellXml(row, col, value, etag='1', batch=''):
+  return ENTRY % {'row': row, 'col': col, 'value': value, 'etag': etag,
+                  'batch': batch}
+
+
+class CellServer(object):
+  """An http_client holding a single-row worksheet, which answers cell
+  feed GETs and cell batch POSTs."""
+
+  def __init__(self, values):
+    self.values = values
+    self.batches = []
+
+  def request(self, http_request):
+    if http_request.method == 'GET':
+      body = FEED % ''.join([CellXml(1, col + 1, value)
+                             for col, value in enumerate(self.values)])
+    else:
+      posted = ''.join(http_request._body_parts)
+      self.batches.append(posted)
+      feed = atom.core.parse(posted, gdata.spreadsheets.data.CellsFeed)
+      entries = []
+      for entry in feed.entry:
+        col = int(entry.cell.col)
+        value = entry.cell.input_value
+        if value is None:
+          raise AssertionError('update without an inputValue')
+        self.values[col - 1] = value
+        entries.append(CellXml(
+            1, col, value, etag='2',
+            batch='<batch:id>%s</batch:id><batch:status code="200"/>'
+                  % entry.batch_id.text))
+      body = FEED % ''.join(entries)
+    response = atom.http_core.HttpResponse(
+        status=200, reason='OK', body=StringIO.StringIO(body))
+    response._headers = {}
+    return response
+
+
+class CellRangeTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = CellServer(['a', 'b', 'c'])
+    self.client = gdata.spreadsheets.client.SpreadsheetsClient()
+    self.client.http_client = self.server
+
+  def test_clearing_a_cell_round_trips(self):
+    cells = self.client.get_range('key', 'od6', 1, 1, 1, 3)
+    self.assertEquals([['a', 'b', 'c']], cells.values)
+    cells.set(1, 2, '')
+    self.assertEquals([(1, 2)], cells.changed_cells())
+
+    results = self.client.update_range(cells)
+    self.assertEquals('200', results[0][2].batch_status.code)
+    self.assertTrue('inputValue=""' in self.server.batches[0])
+    self.assertEquals(['a', '', 'c'], self.server.values)
+    self.assertEquals([], cells.changed_cells())
+    self.assertEquals([['a', '', 'c']],
+                      self.client.get_range('key', 'od6', 1, 1, 1, 3).values)
+
+  def test_writing_zero_does_not_clear_a_cell(self):
+    cells = self.client.get_range('key', 'od6', 1, 1, 1, 3)
+    cells.set(1, 1, 0)
+    self.client.update_range(cells)
+    self.assertTrue('inputValue="0"' in self.server.batches[0])
+    self.assertEquals(['0', 'b', 'c'], self.server.values)
+    self.assertEquals([['0', 'b', 'c']], cells.values)
+
+
+if __name__ == '__main__':
+  unittest.main()